@@ -0,0 +1,170 @@
+"""
+Benchmark the commands on a synthetic corpus, against local stand-ins for
+Postgres, the supplier packages and the geocoder.
+
+    python -m benchmarks.bench_commands [-n 500] [--jobs 4]
+                                        [--compare benchmarks/results/X.json]
+
+Every command runs on its own copy of the corpus. Throughput is files
+per second over the whole command; latencies are the gaps between
+consecutive files completing, which is what a user watching the
+progress bar waits for, including the batching of reads and writes.
+Results are saved as benchmarks/results/<commit>.json.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+RESULTS = Path(__file__).parent / 'results'
+
+
+def git_commit() -> str:
+    def git(*args):
+        return subprocess.run(['git', *args], capture_output=True,
+                              text=True, cwd=Path(__file__).parent
+                              ).stdout.strip()
+    commit = git('rev-parse', '--short', 'HEAD') or 'unknown'
+    if git('status', '--porcelain', '--untracked-files=no'):
+        commit += '-dirty'
+    return commit
+
+
+@contextmanager
+def record_calls(obj, name: str, times: list[float]):
+    """Append the time of every call of obj.name to times."""
+    func = getattr(obj, name)
+
+    def wrapper(*args, **kwargs):
+        result = func(*args, **kwargs)
+        times.append(time.perf_counter())
+        return result
+    setattr(obj, name, wrapper)
+    try:
+        yield
+    finally:
+        setattr(obj, name, func)
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, round(p / 100 * (len(values) - 1)))]
+
+
+def measure(name: str, run, hook: tuple) -> dict:
+    """Run run() while recording file completions through hook."""
+    times = []
+    with record_calls(*hook, times):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+    gaps = [b - a for a, b in zip([start] + times, times)]
+    result = {
+        'files': len(times),
+        'seconds': round(elapsed, 4),
+        'files_per_s': round(len(times) / elapsed, 2),
+        'p50_ms': round(percentile(gaps, 50) * 1000, 3),
+        'p99_ms': round(percentile(gaps, 99) * 1000, 3),
+    }
+    print(f"{name:<20}{result['files']:>7} files {result['seconds']:>9.3f}s"
+          f"{result['files_per_s']:>10.1f}/s  p50 {result['p50_ms']:>8.2f}ms"
+          f"  p99 {result['p99_ms']:>8.2f}ms")
+    return result
+
+
+def compare(results: dict, baseline: dict):
+    print(f"\ncompared with {baseline['commit']}:")
+    for name, result in results.items():
+        # a command that completed no file has no throughput to compare
+        base = baseline['results'].get(name)
+        if base and base['files_per_s'] and result['files_per_s']:
+            speedup = result['files_per_s'] / base['files_per_s']
+            print(f'{name:<20}{speedup:>8.2f}x files/s  p99 '
+                  f"{base['p99_ms']:>8.2f}ms -> {result['p99_ms']:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--jobs', type=int, default=4)
+    parser.add_argument('--compare', type=Path)
+    args = parser.parse_args()
+
+    tmp = Path(tempfile.mkdtemp(prefix='imgmeta-bench-'))
+    # write_meta moves the files it fails on to ./problem
+    os.chdir(tmp)
+    # MetaCache reads XDG_CACHE_HOME on import, stand-ins go in first
+    os.environ['XDG_CACHE_HOME'] = str(tmp / 'cache')
+    from benchmarks import corpus, standins
+    geocoder = standins.install(tmp / 'standins.sqlite')
+
+    from rich.progress import Progress
+
+    from imgmeta import console, script
+    from imgmeta.meta import RenamePlanner
+
+    records = corpus.gen_records(args.n, args.seed)
+    standins.populate(records)
+    start = time.perf_counter()
+    files = corpus.build(tmp / 'corpus', records)
+    print(f'corpus of {len(files)} files built in '
+          f'{time.perf_counter() - start:.1f}s under {tmp}\n')
+    console.quiet = True
+
+    def copy(name):
+        shutil.copytree(tmp / 'corpus', tmp / name)
+        return tmp / name
+
+    results = {}
+    try:
+        a = copy('write_meta')
+        results['write_meta'] = measure(
+            'write_meta', lambda: script.write_meta(
+                [a], jobs=args.jobs, move_with_exception=True),
+            (Progress, 'advance'))
+        results['write_meta rerun'] = measure(
+            'write_meta rerun', lambda: script.write_meta(
+                [a], jobs=args.jobs, move_with_exception=True),
+            (Progress, 'advance'))
+        # leave the written tree for the renames, which need its tags
+        shutil.copytree(a, tmp / 'written')
+        results['clean_file'] = measure(
+            'clean_file', lambda: script.clean_file(a), (os, 'unlink'))
+        for name, command in [('rename', script.rename),
+                              ('rename_awe', script.rename_awe)]:
+            b = tmp / name
+            shutil.copytree(tmp / 'written', b)
+            results[name] = measure(name, lambda: command(
+                [b], new_dir=True, jobs=args.jobs), (RenamePlanner, 'add'))
+    finally:
+        shutil.rmtree(tmp)
+
+    report = {
+        'commit': git_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'n': args.n, 'seed': args.seed, 'jobs': args.jobs,
+        'geocoder_calls': geocoder.calls,
+        'results': results,
+    }
+    RESULTS.mkdir(exist_ok=True)
+    output = RESULTS / f"{report['commit']}.json"
+    output.write_text(json.dumps(report, indent=2))
+    print(f'\nsaved to {output}')
+    if args.compare:
+        compare(results, json.loads(args.compare.read_text()))
+
+
+if __name__ == '__main__':
+    main()
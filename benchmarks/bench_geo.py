@@ -0,0 +1,64 @@
+"""
+Compare imgmeta.geo with the geopy calls it replaces.
+
+    python -m benchmarks.bench_geo [-n 100000]
+"""
+import argparse
+import itertools
+import operator
+import random
+import time
+
+from geopy.distance import geodesic
+
+from imgmeta.geo import distance, round_precision
+
+
+def old_round_precision(lat, lng, tolerance=0.01):
+    for precision in itertools.count(start=1):
+        lat_, lng_ = round(lat, precision), round(lng, precision)
+        if geodesic((lat, lng), (lat_, lng_)).meters < tolerance:
+            return precision
+
+
+def gen_pairs(n, seed=0):
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(n):
+        lat, lng = rng.uniform(-60, 60), rng.uniform(-180, 180)
+        # mostly nearby points, as for photos of the same place
+        d = rng.choice([0.001, 0.01, 0.1, 1])
+        pairs.append(((lat, lng), (lat + rng.uniform(-d, d),
+                                   lng + rng.uniform(-d, d))))
+    return pairs
+
+
+def bench(name, func, n):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f'{name:<36}{elapsed:>9.3f}s {n / elapsed:>14,.0f}/s')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=100_000)
+    n = parser.parse_args().n
+    pairs = gen_pairs(n)
+    locs = [(round(lat, 9), round(lng, 9)) for (lat, lng), _ in pairs]
+
+    bench('geopy geodesic', lambda: [geodesic(a, b).km for a, b in pairs], n)
+    bench('geo.distance (thresholds 1, 20)',
+          lambda: [distance(a, b, [1, 20]) for a, b in pairs], n)
+    bench('round_loc with geopy',
+          lambda: [old_round_precision(*loc) for loc in locs], n)
+    bench('geo.round_precision',
+          lambda: [round_precision(*loc) for loc in locs], n)
+
+    exact = [geodesic(a, b).km > 1 for a, b in pairs]
+    fast = [distance(a, b, [1]) > 1 for a, b in pairs]
+    print(f'threshold disagreements: {sum(map(operator.ne, exact, fast))}')
+
+
+if __name__ == '__main__':
+    main()
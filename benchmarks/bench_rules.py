@@ -0,0 +1,126 @@
+"""
+Compare the tag rules of ImageMetaUpdate, applied through a TagIndex,
+with the scan of every key for every rule they replace, and diff_meta
+with its former comparison order.
+
+    exiftool -json -G -n -r DIR > dump.json
+    python -m benchmarks.bench_rules [dump.json ...] [-n 2000] [--repeat 5]
+
+Without dumps, metas shaped like camera files, a few hundred tags each,
+are generated.
+"""
+import argparse
+import json
+import random
+import time
+
+from imgmeta import console
+from imgmeta.helper import diff_meta
+from imgmeta.meta import ImageMetaUpdate
+
+
+class ScanningUpdate(ImageMetaUpdate):
+    """The rules applied as before, each scanning all the keys."""
+
+    def transfer_tag(self, src_tag, dst_tag, is_move=True, index=None):
+        super().transfer_tag(src_tag, dst_tag, is_move)
+
+
+def old_diff_meta(modified: dict, original: dict):
+    to_write = {}
+    for k, v in modified.items():
+        if k in original:
+            if (o := original[k]) != '':
+                if str(v) == str(o) or v == o:
+                    continue
+        if k.startswith('ICC_Profile'):
+            continue
+        to_write[k] = v
+    return to_write
+
+
+def gen_metas(n: int, seed: int = 0, tags: int = 300) -> list[dict]:
+    rng = random.Random(seed)
+    groups = ['EXIF', 'MakerNotes', 'Composite', 'ICC_Profile', 'XMP',
+              'IPTC', 'File']
+    metas = []
+    for i in range(n):
+        video = rng.random() < 0.3
+        ext = rng.choice(['.mp4', '.mov']) if video else '.jpg'
+        date = (f'20{rng.randint(10, 23)}:{rng.randint(1, 12):02d}:'
+                f'{rng.randint(1, 28):02d} 12:00:00')
+        meta = {
+            'SourceFile': f'/photos/{i}{ext}',
+            'File:FileName': f'{i}{ext}',
+            'File:MIMEType': ('video/mp4' if ext == '.mp4' else
+                              'video/quicktime' if video else 'image/jpeg'),
+        }
+        for j in range(tags):
+            group = rng.choice(groups)
+            meta[f'{group}:Tag{j}'] = rng.choice(
+                [rng.randint(0, 1 << 16), rng.random(), f'value {j}', ''])
+        group = 'QuickTime' if video else 'EXIF'
+        meta |= {
+            f'{group}:CreateDate': date,
+            f'{group}:Title': f'title {i}',
+            f'{group}:Artist': rng.choice(['', f'artist{i % 40}']),
+            'EXIF:ImageDescription': rng.choice(['', f'post {i}']),
+            'IPTC:Keywords': rng.choice(['', 'weibo']),
+            'XMP:DateCreated': rng.choice(['', date]),
+        }
+        metas.append(meta)
+    return metas
+
+
+def apply_rules(cls, metas: list[dict]) -> list[dict]:
+    results = []
+    for meta in metas:
+        update = cls(meta)
+        update.move_meta()
+        update.copy_meta()
+        results.append(update.meta)
+    return results
+
+
+def bench(name, func, n, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    print(f'{name:<36}{best:>9.3f}s {n / best:>14,.0f}/s')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dumps', nargs='*')
+    parser.add_argument('-n', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    if args.dumps:
+        metas = [m for dump in args.dumps
+                 for m in json.load(open(dump)) if 'File:MIMEType' in m]
+    else:
+        metas = gen_metas(args.n)
+    n = len(metas)
+    tags = sum(map(len, metas)) / n
+    print(f'{n} metas, {tags:.0f} tags each on average\n')
+    # conflicts are logged for every run
+    console.quiet = True
+
+    old = bench('rules, scanning every key', lambda: apply_rules(
+        ScanningUpdate, metas), n, args.repeat)
+    new = bench('rules, through a TagIndex', lambda: apply_rules(
+        ImageMetaUpdate, metas), n, args.repeat)
+    assert old == new
+    pairs = list(zip(new, metas))
+    old = bench('diff_meta, str() first', lambda: [
+        old_diff_meta(*p) for p in pairs], n, args.repeat)
+    new = bench('diff_meta', lambda: [
+        diff_meta(*p) for p in pairs], n, args.repeat)
+    assert old == new
+
+
+if __name__ == '__main__':
+    main()
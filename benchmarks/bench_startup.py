@@ -0,0 +1,64 @@
+"""
+Measure the cold start of the CLI in fresh interpreters.
+
+    python -m benchmarks.bench_startup [-n 20] [--top 10]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+TARGETS = {
+    'import imgmeta.script': ['-c', 'import imgmeta.script'],
+    'imgmeta --help': ['-c', 'from imgmeta.script import app; app()',
+                       '--help'],
+}
+
+
+def wall_times(args, n):
+    times = []
+    for _ in range(n):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], check=True,
+                       stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def import_times(module):
+    """Cumulative microseconds per module imported by module, from -X."""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        check=True, capture_output=True, text=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.removeprefix('import time:').split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=20)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    for name, cmd in TARGETS.items():
+        times = wall_times(cmd, args.n)
+        print(f'{name:<28}median {statistics.median(times) * 1000:>7.1f}ms'
+              f'  min {min(times) * 1000:>7.1f}ms')
+
+    python = statistics.median(wall_times(['-c', 'pass'], args.n))
+    print(f'{"bare interpreter":<28}median {python * 1000:>7.1f}ms')
+
+    times = import_times('imgmeta.script')
+    print('\nslowest imports of imgmeta.script (cumulative):')
+    for name, us in sorted(times.items(), key=lambda x: -x[1])[:args.top]:
+        print(f'{us / 1000:>9.1f}ms  {name}')
+
+
+if __name__ == '__main__':
+    main()
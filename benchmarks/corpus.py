@@ -0,0 +1,211 @@
+"""
+Synthetic media corpus for benchmarks.
+
+gen_records draws the supplier posts behind the files, which
+benchmarks.standins.populate stores, and build writes a tree of tiny
+jpg/png/heic/mp4/mov files tagged by exiftool the way the downloaders
+leave them: half of them fresh, with only the supplier ids and the
+original EXIF/QuickTime tags, and half of them already processed by an
+earlier write_meta.
+"""
+import base64
+import random
+import struct
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from exiftool import ExifToolHelper
+from exiftool.exceptions import ExifToolExecuteError
+
+from benchmarks.standins import encode_wb_id
+
+SUPPLIERS = {
+    # supplier: (name in XMP, girl column, first user id)
+    'weibo': ('Weibo', 'sina', 1_000_000_000),
+    'redbook': ('RedBook', 'red', 2_000_000_000),
+    'aweme': ('Aweme', 'awe', 3_000_000_000),
+    'instagram': ('Instagram', 'inst', 4_000_000_000),
+    'twitter': ('Twitter', None, 5_000_000_000),
+}
+EXTENSIONS = ['.jpg'] * 6 + ['.png', '.heic', '.mp4', '.mov']
+
+_JPEG = base64.b64decode(
+    '/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDABALDA4MChAODQ4SERATGCgaGBYWGDEjJR0oOj'
+    'M9PDkzODdASFxOQERXRTc4UG1RV19iZ2hnPk1xeXBkeFxlZ2P/2wBDARESEhgVGC8aGi9j'
+    'QjhCY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2'
+    'P/wAARCAAIAAgDASIAAhEBAxEB/8QAHwAAAQUBAQEBAQEAAAAAAAAAAAECAwQFBgcICQoL'
+    '/8QAtRAAAgEDAwIEAwUFBAQAAAF9AQIDAAQRBRIhMUEGE1FhByJxFDKBkaEII0KxwRVS0f'
+    'AkM2JyggkKFhcYGRolJicoKSo0NTY3ODk6Q0RFRkdISUpTVFVWV1hZWmNkZWZnaGlqc3R1'
+    'dnd4eXqDhIWGh4iJipKTlJWWl5iZmqKjpKWmp6ipqrKztLW2t7i5usLDxMXGx8jJytLT1N'
+    'XW19jZ2uHi4+Tl5ufo6erx8vP09fb3+Pn6/8QAHwEAAwEBAQEBAQEBAQAAAAAAAAECAwQF'
+    'BgcICQoL/8QAtREAAgECBAQDBAcFBAQAAQJ3AAECAxEEBSExBhJBUQdhcRMiMoEIFEKRob'
+    'HBCSMzUvAVYnLRChYkNOEl8RcYGRomJygpKjU2Nzg5OkNERUZHSElKU1RVVldYWVpjZGVm'
+    'Z2hpanN0dXZ3eHl6goOEhYaHiImKkpOUlZaXmJmaoqOkpaanqKmqsrO0tba3uLm6wsPExc'
+    'bHyMnK0tPU1dbX2Nna4uPk5ebn6Onq8vP09fb3+Pn6/9oADAMBAAIRAxEAPwCaiiivPPUP'
+    '/9k=')
+
+
+def _png() -> bytes:
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data)))
+    ihdr = struct.pack('>IIBBBBB', 8, 8, 8, 2, 0, 0, 0)
+    idat = zlib.compress(b''.join(b'\0' + b'\xc8\x78\x50' * 8
+                                  for _ in range(8)))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', ihdr)
+            + chunk(b'IDAT', idat) + chunk(b'IEND', b''))
+
+
+def _box(kind: bytes, *payload: bytes) -> bytes:
+    data = b''.join(payload)
+    return struct.pack('>I', 8 + len(data)) + kind + data
+
+
+def _full_box(kind: bytes, version: int, *payload: bytes) -> bytes:
+    return _box(kind, struct.pack('>I', version << 24), *payload)
+
+
+def _quicktime(brand: bytes) -> bytes:
+    # an empty movie: exiftool only needs a well formed moov to write
+    mvhd = _full_box(b'mvhd', 0, struct.pack(
+        '>IIII', 0, 0, 1000, 0), struct.pack('>IH', 0x10000, 0x100),
+        bytes(10), struct.pack('>9I', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0,
+                               0x40000000), bytes(24),
+        struct.pack('>I', 1))
+    return (_box(b'ftyp', brand, struct.pack('>I', 0), brand)
+            + _box(b'moov', mvhd) + _box(b'mdat'))
+
+
+def _heic() -> bytes:
+    # a single hvc1 item whose data is a few bytes of mdat
+    data = bytes(16)
+    hdlr = _full_box(b'hdlr', 0, bytes(4), b'pict', bytes(13))
+    pitm = _full_box(b'pitm', 0, struct.pack('>H', 1))
+    iinf = _full_box(b'iinf', 0, struct.pack('>H', 1), _full_box(
+        b'infe', 2, struct.pack('>HH', 1, 0), b'hvc1', b'\0'))
+    ftyp = _box(b'ftyp', b'heic', struct.pack('>I', 0), b'mif1heic')
+
+    def iloc(offset):
+        return _full_box(b'iloc', 0, struct.pack(
+            '>BBHHHHII', 0x44, 0, 1, 1, 0, 1, offset, len(data)))
+    meta = _full_box(b'meta', 0, hdlr, pitm, iloc(0), iinf)
+    offset = len(ftyp) + len(meta) + 8
+    meta = _full_box(b'meta', 0, hdlr, pitm, iloc(offset), iinf)
+    return ftyp + meta + _box(b'mdat', data)
+
+
+TEMPLATES = {
+    '.jpg': _JPEG,
+    '.png': _png(),
+    '.heic': _heic(),
+    '.mp4': _quicktime(b'isom'),
+    '.mov': _quicktime(b'qt  '),
+}
+
+
+def gen_records(n: int, seed: int = 0, artists: int = 40) -> list[dict]:
+    """Supplier posts of n files, a few files per post."""
+    rng = random.Random(seed)
+    pool = []
+    for i in range(artists):
+        supplier = rng.choice(list(SUPPLIERS))
+        _, girl_col, first_id = SUPPLIERS[supplier]
+        pool.append((supplier, f'artist{i:03d}', first_id + i, girl_col))
+    records = []
+    while len(records) < n:
+        supplier, artist, user_id, girl_col = rng.choice(pool)
+        post = dict(supplier=supplier, artist=artist, user_id=user_id,
+                    girl_col=girl_col or 'sina',
+                    id=rng.randrange(10**15, 10**16),
+                    created_at=datetime(2020, 1, 1) + timedelta(
+                        minutes=rng.randrange(5 * 365 * 24 * 60)))
+        if supplier in ('weibo', 'aweme', 'instagram'):
+            if supplier == 'aweme' or rng.random() < 0.7:
+                post |= dict(latitude=round(rng.uniform(20, 40), 6),
+                             longitude=round(rng.uniform(100, 120), 6))
+            else:
+                post |= dict(latitude=None, longitude=None)
+        for sn in range(1, rng.randint(1, 4) + 1):
+            records.append(post | dict(sn=sn, ext=rng.choice(EXTENSIONS),
+                                       processed=rng.random() < 0.5))
+    return records[:n]
+
+
+def gen_tags(r: dict) -> dict:
+    name = SUPPLIERS[r['supplier']][0]
+    unique_id = (encode_wb_id(r['id']) if r['supplier'] == 'weibo'
+                 else str(r['id']))
+    date = f"{r['created_at']:%Y:%m:%d %H:%M:%S}"
+    tags = {
+        'XMP:ImageSupplierName': name,
+        'XMP:ImageSupplierID': r['user_id'],
+        'XMP:ImageUniqueID': unique_id,
+        'XMP:SeriesNumber': r['sn'],
+    }
+    if r['supplier'] == 'twitter':
+        tags['XMP:ImageCreatorName'] = r['artist']
+    if r['ext'] in ('.mp4', '.mov'):
+        tags |= {'QuickTime:CreateDate': date,
+                 'QuickTime:Title': f"post {r['id']}"}
+    else:
+        tags |= {'EXIF:CreateDate': date,
+                 'EXIF:ImageDescription': f"post {r['id']}"}
+    if r['processed']:
+        title = f"{r['artist']}-{r['created_at']:%y-%m-%d-%H%M}-{r['sn']}"
+        description = f"post {r['id']} https://example.com/{r['id']}"
+        tags |= {
+            'XMP:Artist': r['artist'],
+            'XMP:ImageCreatorName': r['artist'],
+            'XMP:DateCreated': date,
+            'XMP:BlogTitle': f"post {r['id']}",
+            'XMP:BlogURL': f"https://example.com/{r['id']}",
+            'XMP:Title': title,
+            'XMP:Caption': title,
+            'XMP:Description': description,
+            'XMP:UserComment': description,
+            'XMP:RawFileName': file_name(r),
+            'XMP:Subject': [r['supplier']],
+        }
+        if r.get('latitude'):
+            tags |= {'XMP:GPSLatitude': r['latitude'],
+                     'XMP:GPSLongitude': r['longitude'],
+                     'XMP:Geography': f"{r['latitude']} {r['longitude']}"}
+    return tags
+
+
+def file_name(r: dict) -> str:
+    if r['supplier'] == 'instagram':
+        return f"insta_{r['id']}_{r['user_id']}_{r['sn']}{r['ext']}"
+    return f"{r['user_id']}_{r['id']}_{r['sn']}{r['ext']}"
+
+
+def build(root: Path, records: list[dict]) -> list[Path]:
+    """
+    Write and tag the files of records under root, by supplier and
+    artist, along with the .DS_Store and *_original leftovers clean_file
+    removes. Returns the files that could be tagged.
+    """
+    files = []
+    for r in records:
+        path = root / r['supplier'] / r['artist'] / file_name(r)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(TEMPLATES[r['ext']])
+        files.append((path, gen_tags(r)))
+    for folder in {path.parent for path, _ in files}:
+        (folder / '.DS_Store').write_bytes(bytes(64))
+    tagged = []
+    with ExifToolHelper() as et:
+        for path, tags in files:
+            try:
+                et.set_tags([path], tags,
+                            params=['-overwrite_original', '-n'])
+            except ExifToolExecuteError as e:
+                print(f'{path.suffix}: cannot tag, skipped: {e.stderr}')
+                path.unlink()
+                continue
+            tagged.append(path)
+    for path in tagged[::10]:
+        backup = path.with_suffix(path.suffix + '_original')
+        backup.write_bytes(path.read_bytes())
+    return tagged
@@ -0,0 +1,291 @@
+"""
+Local stand-ins for the services imgmeta talks to, for benchmarks.
+
+install() registers SQLite-backed replacements for the supplier packages
+(sinaspider, redbook, aweme, insmeta, twimeta and photosinfo) in
+sys.modules, binds the imgmeta models to the same database and gives
+Geolocation a stub geocoder, so that the commands run end to end without
+Postgres, the supplier stacks or the network. It has to be called before
+anything imports the supplier packages.
+"""
+import hashlib
+import re
+import string
+import sys
+import types
+from collections import namedtuple
+
+from peewee import (BigIntegerField, DateTimeField, DoubleField,
+                    IntegerField, Model, SqliteDatabase, TextField)
+
+db = SqliteDatabase(None)
+
+
+class _Model(Model):
+    class Meta:
+        database = db
+
+
+class _Artist(_Model):
+    user_id = BigIntegerField(primary_key=True)
+    username = TextField()
+    photos_num = IntegerField(default=0)
+
+    supplier = ''
+
+    @classmethod
+    def from_id(cls, user_id):
+        return cls.get_by_id(user_id)
+
+    @property
+    def xmp_info(self):
+        return {
+            'XMP:Artist': self.username,
+            'XMP:ImageCreatorName': self.username,
+            'XMP:ImageSupplierID': self.user_id,
+            'XMP:ImageSupplierName': self.supplier,
+        }
+
+
+class _Post(_Model):
+    user_id = BigIntegerField()
+    created_at = DateTimeField()
+    text = TextField()
+    url = TextField()
+    latitude = DoubleField(null=True)
+    longitude = DoubleField(null=True)
+
+    supplier = ''
+    location_tag = None
+
+    @property
+    def unique_id(self) -> str:
+        return str(self.id)
+
+    def gen_meta(self, sn=None) -> dict:
+        meta = {
+            'XMP:ImageUniqueID': self.unique_id,
+            'XMP:ImageSupplierID': self.user_id,
+            'XMP:ImageSupplierName': self.supplier,
+            'XMP:DateCreated': f'{self.created_at:%Y:%m:%d %H:%M:%S}',
+            'XMP:BlogTitle': self.text,
+            'XMP:BlogURL': self.url,
+        }
+        if sn:
+            meta['XMP:SeriesNumber'] = sn
+        if self.location_tag:
+            meta[self.location_tag] = (self.latitude, self.longitude)
+        return meta
+
+
+def _artist(name, supplier, table_name):
+    return type(name, (_Artist,), {
+        'supplier': supplier, '__module__': __name__,
+        'Meta': type('Meta', (), {'table_name': table_name})})
+
+
+WeiboArtist = _artist('WeiboArtist', 'Weibo', 'weibo_artist')
+RedArtist = _artist('RedArtist', 'RedBook', 'red_artist')
+AweArtist = _artist('AweArtist', 'Aweme', 'awe_artist')
+InstaArtist = _artist('InstaArtist', 'Instagram', 'insta_artist')
+TwiArtist = _artist('TwiArtist', 'Twitter', 'twi_artist')
+
+
+@classmethod
+def _twi_from_id(cls, user_id):
+    return cls.get_or_none((cls.user_id == user_id)
+                           | (cls.username == str(user_id)))
+
+
+@property
+def _insta_artist_meta(self):
+    return self.xmp_info
+
+
+TwiArtist.from_id = _twi_from_id
+InstaArtist.meta = _insta_artist_meta
+
+
+class Weibo(_Post):
+    id = BigIntegerField(primary_key=True)
+    bid = TextField(unique=True)
+
+    supplier = 'Weibo'
+    location_tag = 'WeiboLocation'
+
+    @property
+    def unique_id(self) -> str:
+        return self.bid
+
+
+class WeiboMissed(Weibo):
+    class Meta:
+        table_name = 'weibo_missed'
+
+
+class Note(_Post):
+    id = TextField(primary_key=True)
+
+    supplier = 'RedBook'
+
+
+class Post(_Post):
+    id = BigIntegerField(primary_key=True)
+
+    supplier = 'Aweme'
+    location_tag = 'AwemeLocation'
+
+    @classmethod
+    def from_id(cls, id):
+        return cls.get_by_id(id)
+
+
+class Insta(_Post):
+    id = BigIntegerField(primary_key=True)
+
+    supplier = 'Instagram'
+    location_tag = 'InstagramLocation'
+
+    @classmethod
+    def from_id(cls, id, user_id=None):
+        return cls.get_by_id(id)
+
+    @property
+    def meta(self):
+        return self.gen_meta()
+
+
+class Twitter(_Post):
+    id = BigIntegerField(primary_key=True)
+    username = TextField()
+
+    supplier = 'Twitter'
+
+    def gen_meta(self, sn=None) -> dict:
+        return super().gen_meta(sn) | {
+            'XMP:ImageCreatorName': self.username}
+
+
+class Girl(_Model):
+    username = TextField(unique=True)
+    folder = TextField(null=True)
+    sina_id = BigIntegerField(null=True)
+    sina_num = IntegerField(default=0)
+    red_id = BigIntegerField(null=True)
+    red_num = IntegerField(default=0)
+    inst_id = BigIntegerField(null=True)
+    inst_num = IntegerField(default=0)
+    awe_id = BigIntegerField(null=True)
+    awe_num = IntegerField(default=0)
+
+
+SUPPLIER_MODELS = {
+    'weibo': (Weibo, WeiboArtist),
+    'redbook': (Note, RedArtist),
+    'aweme': (Post, AweArtist),
+    'instagram': (Insta, InstaArtist),
+    'twitter': (Twitter, TwiArtist),
+}
+MODELS = [WeiboArtist, RedArtist, AweArtist, InstaArtist, TwiArtist,
+          Weibo, WeiboMissed, Note, Post, Insta, Twitter, Girl]
+
+_ALPHABET = string.digits + string.ascii_letters
+
+
+def encode_wb_id(id: int) -> str:
+    """Base 62 in groups of 7 digits, as weibo encodes its mids."""
+    groups = []
+    for i in range(len(s := str(id)), 0, -7):
+        n, group = int(s[max(i - 7, 0):i]), ''
+        while n:
+            n, r = divmod(n, 62)
+            group = _ALPHABET[r] + group
+        groups.append(group.rjust(4, '0') if i > 7 else group)
+    return ''.join(reversed(groups))
+
+
+def get_id_from_filename(filename: str) -> tuple[int, int] | None:
+    if m := re.match(r'insta_(\d+)_(\d+)', filename):
+        return int(m[1]), int(m[2])
+
+
+class StubGeocoder:
+    """Deterministic geocode(query) answering without the network."""
+
+    Location = namedtuple('Location', 'address latitude longitude')
+
+    def __init__(self):
+        self.calls = 0
+
+    def geocode(self, query, language=None):
+        self.calls += 1
+        if 'nowhere' in query:
+            return
+        h = int(hashlib.md5(query.encode()).hexdigest(), 16)
+        return self.Location(f'{query}, stub', 20 + h % 2000 / 100,
+                             100 + h // 2000 % 2000 / 100)
+
+
+def _module(name: str, **attrs):
+    module = sys.modules[name] = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    if '.' in name:
+        parent, child = name.rsplit('.', 1)
+        setattr(sys.modules[parent], child, module)
+    return module
+
+
+def install(path) -> StubGeocoder:
+    """Register the stand-ins backed by the SQLite database at path."""
+    db.init(str(path), pragmas={'journal_mode': 'wal'})
+    db.create_tables(MODELS)
+
+    _module('sinaspider')
+    _module('sinaspider.model', Artist=WeiboArtist, Weibo=Weibo,
+            WeiboMissed=WeiboMissed)
+    _module('sinaspider.helper', encode_wb_id=encode_wb_id)
+    _module('redbook')
+    _module('redbook.model', Artist=RedArtist, Note=Note)
+    _module('aweme')
+    _module('aweme.model', Artist=AweArtist, Post=Post)
+    _module('insmeta')
+    _module('insmeta.model', Artist=InstaArtist, Insta=Insta,
+            get_id_from_filename=get_id_from_filename)
+    _module('twimeta')
+    _module('twimeta.model', Artist=TwiArtist, Twitter=Twitter)
+    _module('photosinfo')
+    _module('photosinfo.model', Girl=Girl)
+
+    from imgmeta.model import Geolocation, GeolocationMissed, TokenBucket
+    db.bind([Geolocation, GeolocationMissed])
+    db.create_tables([Geolocation, GeolocationMissed])
+    Geolocation.locator = geocoder = StubGeocoder()
+    Geolocation.rate_limiter = TokenBucket(rate=1e9, capacity=1e9)
+    return geocoder
+
+
+def populate(records: list[dict]):
+    """
+    Insert the supplier records of a corpus, as returned by
+    benchmarks.corpus.gen_records.
+    """
+    with db.atomic():
+        for r in records:
+            model, artist = SUPPLIER_MODELS[r['supplier']]
+            artist.insert(user_id=r['user_id'], username=r['artist'],
+                          photos_num=r['user_id'] % 3).on_conflict_ignore(
+            ).execute()
+            fields = dict(
+                id=r['id'], user_id=r['user_id'],
+                created_at=r['created_at'],
+                text=f"post {r['id']}", url=f"https://example.com/{r['id']}",
+                latitude=r.get('latitude'), longitude=r.get('longitude'))
+            if model is Weibo:
+                fields['bid'] = encode_wb_id(r['id'])
+            elif model is Twitter:
+                fields['username'] = r['artist']
+            model.insert(**fields).on_conflict_ignore().execute()
+            Girl.insert(username=r['artist'], folder=r['artist'][:3], **{
+                f"{r['girl_col']}_id": r['user_id'],
+                f"{r['girl_col']}_num": r['user_id'] % 3,
+            }).on_conflict_ignore().execute()
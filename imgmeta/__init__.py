@@ -1,6 +1,12 @@
 """
 Write Image Meta
 """
+import inspect
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
 import click
 import typer
 from rich import traceback
@@ -22,7 +28,56 @@ custom_theme = Theme({
     "error": "bold bright_red on dark_red",
     "notice": "bold magenta"
 })
-console = Console(theme=custom_theme, log_time=False, highlight=False)
+_held = threading.local()
+
+
+class _Console(Console):
+    """
+    Console whose log calls on a thread can be held back by hold_logs,
+    along with where they were made, and replayed later by replay_logs,
+    so that logs of pipeline stages come out in file order.
+    """
+
+    def log(self, *objects, _stack_offset: int = 1, **kwargs):
+        if (held := getattr(_held, 'logs', None)) is not None:
+            frame = sys._getframe(_stack_offset)
+            held.append((objects, kwargs,
+                         (frame.f_code.co_filename, frame.f_lineno, {})))
+            return
+        super().log(*objects, _stack_offset=_stack_offset + 1, **kwargs)
+
+    def _caller_frame_info(self, offset, currentframe=inspect.currentframe):
+        if caller := getattr(_held, 'caller', None):
+            return caller
+        return super()._caller_frame_info(offset + 1, currentframe)
+
+    @contextmanager
+    def hold_logs(self) -> Iterator[list]:
+        """
+        Hold the logs of this thread in the list yielded, replaying them
+        at once if the block raises, as they may tell why.
+        """
+        assert getattr(_held, 'logs', None) is None
+        _held.logs = logs = []
+        try:
+            yield logs
+        except BaseException:
+            _held.logs = None
+            self.replay_logs(logs)
+            raise
+        finally:
+            _held.logs = None
+
+    def replay_logs(self, logs: list):
+        for objects, kwargs, caller in logs:
+            _held.caller = caller
+            try:
+                super().log(*objects, **kwargs)
+            finally:
+                _held.caller = None
+
+
+console = _Console(theme=custom_theme, log_time=False, highlight=False)
 
 
 def get_progress(disable=False):
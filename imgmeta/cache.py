@@ -0,0 +1,116 @@
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Callable
+
+from imgmeta.xmp import sidecar_path
+
+CACHE_PATH = Path(os.environ.get('XDG_CACHE_HOME', Path.home()/'.cache')
+                  )/'imgmeta'/'meta.sqlite'
+
+
+class MetaCache:
+    """
+    On-disk record of files found up to date by write_meta.
+
+    Entries are keyed by the absolute path and only valid while the inode,
+    size and mtime_ns of the file, and the size and mtime_ns of its XMP
+    sidecar or its absence, are unchanged, so a file or sidecar rewritten
+    by anyone, set_tags included, misses the cache automatically.
+    """
+
+    def __init__(self, path: Path = CACHE_PATH, commit_every: int = 256):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS meta ('
+            'path TEXT PRIMARY KEY, inode INTEGER, size INTEGER, '
+            'mtime_ns INTEGER, meta TEXT, xmp_info TEXT, sidecar TEXT)')
+        columns = {row[1] for row in
+                   self.conn.execute('PRAGMA table_info(meta)')}
+        if 'sidecar' not in columns:
+            # entries made before sidecars were tracked never match
+            self.conn.execute('ALTER TABLE meta ADD COLUMN sidecar TEXT')
+        self.commit_every = commit_every
+        self._uncommitted = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self.conn.commit()
+            self.conn.close()
+
+    @staticmethod
+    def _stat(img: Path) -> tuple[str, int, int, int, str]:
+        st = os.stat(img)
+        try:
+            xmp = os.stat(sidecar_path(img))
+        except FileNotFoundError:
+            sidecar = ''
+        else:
+            sidecar = f'{xmp.st_size}:{xmp.st_mtime_ns}'
+        return (str(Path(img).absolute()), st.st_ino, st.st_size,
+                st.st_mtime_ns, sidecar)
+
+    def get(self, img: Path) -> tuple[dict, dict] | None:
+        """Return (meta, xmp_info) stored for img if it is unchanged."""
+        path, *stat = self._stat(img)
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT inode, size, mtime_ns, sidecar, meta, xmp_info '
+                'FROM meta WHERE path = ?', (path,)).fetchone()
+        if not row or list(row[:4]) != stat:
+            return
+        return json.loads(row[4]), json.loads(row[5])
+
+    def fresh(self, img: Path) -> bool:
+        """Whether img has an entry still valid, without decoding it."""
+        path, *stat = self._stat(img)
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT inode, size, mtime_ns, sidecar '
+                'FROM meta WHERE path = ?', (path,)).fetchone()
+        return bool(row) and list(row) == stat
+
+    def put(self, img: Path, meta: dict, xmp_info: dict):
+        path, *stat = self._stat(img)
+        with self._lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO meta (path, inode, size, mtime_ns, '
+                'sidecar, meta, xmp_info) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (path, *stat, json.dumps(meta, default=str),
+                 json.dumps(xmp_info, default=str)))
+            self._commit()
+
+    def invalidate(self, img: Path):
+        with self._lock:
+            self.conn.execute('DELETE FROM meta WHERE path = ?',
+                              (str(Path(img).absolute()),))
+            self._commit()
+
+    def _commit(self):
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_every:
+            self.conn.commit()
+            self._uncommitted = 0
+
+    def cached_read(self, read: Callable) -> Callable:
+        """
+        Wrap read(et, etl, imgs) of imgmeta.exif so that unchanged files
+        are served from the cache instead of exiftool.
+        """
+        def wrapper(et, etl, imgs):
+            hits = {img: entry[0] for img in imgs if (entry := self.get(img))}
+            misses = [img for img in imgs if img not in hits]
+            metas = dict(zip(misses, read(et, etl, misses) if misses else []))
+            return [hits.get(img) or metas[img] for img in imgs]
+        return wrapper
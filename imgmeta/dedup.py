@@ -0,0 +1,69 @@
+"""
+Find files with the same content, for `write_meta --skip-duplicates`.
+"""
+import hashlib
+import os
+from pathlib import Path
+
+from imgmeta.helper import hash_file
+
+try:
+    from xxhash import xxh3_128 as _hash
+except ImportError:
+    def _hash():
+        return hashlib.blake2b(digest_size=16)
+
+SAMPLE = 64 * 2**10
+
+
+def sample_hash(path: Path, size: int) -> bytes:
+    """Hash of the head, middle and tail of path, all of it if small."""
+    digest = _hash()
+    with open(path, 'rb') as f:
+        if size <= 3 * SAMPLE:
+            digest.update(f.read())
+        else:
+            for offset in [0, size // 2 - SAMPLE // 2, size - SAMPLE]:
+                f.seek(offset)
+                digest.update(f.read(SAMPLE))
+    return digest.digest()
+
+
+def full_hash(path: Path) -> bytes:
+    return hash_file(path, _hash())
+
+
+class DupIndex:
+    """
+    Content index of the files added, by size, then by a sampled hash,
+    then by a full hash. Files are only hashed once another file of the
+    same size shows up, and fully once their samples match too.
+    """
+
+    def __init__(self):
+        self._sizes: dict[int, list[Path]] = {}
+        self._samples: dict[Path, bytes] = {}
+        self._fulls: dict[Path, bytes] = {}
+
+    def _sample(self, path: Path, size: int) -> bytes:
+        if (h := self._samples.get(path)) is None:
+            h = self._samples[path] = sample_hash(path, size)
+        return h
+
+    def _full(self, path: Path, size: int) -> bytes:
+        if size <= 3 * SAMPLE:
+            return self._sample(path, size)
+        if (h := self._fulls.get(path)) is None:
+            h = self._fulls[path] = full_hash(path)
+        return h
+
+    def add(self, path: Path) -> Path | None:
+        """Add path, returning the first file added with its content."""
+        if not (size := os.stat(path).st_size):
+            return
+        primaries = self._sizes.setdefault(size, [])
+        for primary in primaries:
+            if (self._sample(primary, size) == self._sample(path, size)
+                    and self._full(primary, size) == self._full(path, size)):
+                return primary
+        primaries.append(path)
@@ -0,0 +1,241 @@
+import itertools
+import os
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+from exiftool import ExifTool, ExifToolHelper
+from exiftool.exceptions import ExifToolExecuteError
+
+from imgmeta import profile
+from imgmeta.xmp import read_tags, sidecar_path
+
+
+def sidecar_patch(to_write: dict) -> dict:
+    """
+    The part of a patch a sidecar can hold: the XMP tags set to a value.
+    Removals and the other groups are left to a write to the file itself.
+    """
+    return {k: v for k, v in to_write.items()
+            if k.startswith('XMP:') and v != ''}
+
+
+def read_sidecars(et: ExifToolHelper, files: list[str],
+                  tags: list[str] = None) -> dict[str, dict]:
+    """The XMP tags of the sidecars of files, by file, for those having one."""
+    sidecars = [str(sidecar_path(f)) for f in files
+                if os.path.exists(sidecar_path(f))]
+    if not sidecars:
+        return {}
+    if tags is None:
+        metas = et.get_metadata(sidecars)
+    elif tags := [t for t in tags if t.startswith('XMP:')]:
+        metas = et.get_tags(sidecars, tags)
+    else:
+        return {}
+    return {m['SourceFile'].removesuffix('.xmp'): {
+        k: v for k, v in m.items() if k.startswith('XMP:')} for m in metas}
+
+
+@profile.timed('exiftool.read')
+def get_meta(et: ExifToolHelper, etl: ExifTool, imgs: list[Path],
+             gps: bool = True, sidecars: bool = True) -> list[dict]:
+    """
+    Read full metadata of imgs in one exiftool call, merged with the
+    `-G1 -n` Keys:GPSCoordinates read by etl in a second call and, unless
+    sidecars is False, overridden by the XMP of their sidecars.
+    """
+    files = [str(img) for img in imgs]
+    metas = {m['SourceFile']: m for m in et.get_metadata(files)}
+    if gps:
+        for m in etl.execute_json(*files, '-Keys:GPSCoordinates'):
+            metas[m['SourceFile']] |= m
+    if sidecars:
+        for f, xmp in read_sidecars(et, files).items():
+            metas[f] |= xmp
+    return [metas[f] for f in files]
+
+
+@profile.timed('exiftool.read')
+def get_tags(et: ExifToolHelper, etl: ExifTool,
+             imgs: list[Path], tags: list[str]) -> list[dict]:
+    """
+    Read only tags of imgs, with the fastest read depth safe per format.
+
+    -fast2 stops at the mdat atom of QuickTime-based files and at the IDAT
+    chunk of PNGs, after which XMP may still be stored, so it is kept to
+    formats holding their metadata up front; the rest are read with -fast.
+    The XMP tags of sidecars override those of the files.
+
+    Files whose tags imgmeta.xmp can read are not passed to exiftool.
+    """
+    fast2_ext = ('.jpg', '.jpeg', '.gif', '.webp')
+    files = [str(img) for img in imgs]
+    metas = {}
+    for f in files:
+        if (m := read_tags(f, tags)) is not None:
+            metas[f] = m
+    rest = [f for f in files if f not in metas]
+    profile.count('xmp.native', len(files) - len(rest))
+    for fast in ['-fast2', '-fast']:
+        group = [f for f in rest
+                 if f.lower().endswith(fast2_ext) == (fast == '-fast2')]
+        if group:
+            for m in et.get_tags(group, tags, params=[fast]):
+                metas[m['SourceFile']] = m
+    for f, xmp in read_sidecars(et, rest, tags).items():
+        metas[f] |= xmp
+    return [metas[f] for f in files]
+
+
+def batched(iterable: Iterable, n: int) -> Iterator[list]:
+    it = iter(iterable)
+    while chunk := list(itertools.islice(it, n)):
+        yield chunk
+
+
+class ExifToolPool:
+    """
+    A pool of persistent exiftool processes shared by threads.
+
+    Every worker is an (ExifToolHelper, ExifTool) pair, the latter
+    started with `-G1 -n`; functions run on the pool are called as
+    func(et, etl, *args) with exclusive use of one worker.
+    """
+
+    def __init__(self, jobs: int = 1):
+        assert jobs >= 1
+        self.jobs = jobs
+        self._workers = []
+        self._idle = queue.SimpleQueue()
+        self._executor = None
+
+    def __enter__(self):
+        for _ in range(self.jobs):
+            et, etl = ExifToolHelper(), ExifTool(common_args=['-G1', '-n'])
+            et.run()
+            etl.run()
+            self._workers.append((et, etl))
+            self._idle.put((et, etl))
+        self._executor = ThreadPoolExecutor(self.jobs)
+        return self
+
+    def __exit__(self, *exc):
+        self._executor.shutdown(cancel_futures=True)
+        for et, etl in self._workers:
+            et.terminate()
+            etl.terminate()
+
+    def run(self, func: Callable, *args):
+        """Call func on the first idle worker, blocking until it returns."""
+        worker = self._idle.get()
+        try:
+            return func(*worker, *args)
+        finally:
+            self._idle.put(worker)
+
+    def map(self, func: Callable, iterable: Iterable) -> Iterator:
+        """
+        Like Executor.map, but consume iterable lazily, keeping at most
+        two items per worker in flight, and yield results in order.
+        """
+        futures = deque()
+        for item in iterable:
+            futures.append(self._executor.submit(self.run, func, item))
+            if len(futures) >= 2 * self.jobs:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
+def read_batch(et: ExifToolHelper, etl: ExifTool, imgs: list[Path],
+               read: Callable = get_meta) -> list[dict | None]:
+    """
+    Read imgs with read(et, etl, imgs); when exiftool fails on the batch,
+    meta is None for every img of it, and the caller should read them one
+    by one to locate the problem file.
+    """
+    try:
+        return read(et, etl, imgs)
+    except ExifToolExecuteError:
+        return [None] * len(imgs)
+
+
+def iter_meta(pool: ExifToolPool, imgs: Iterable[Path],
+              batch_size: int = 64, read: Callable = get_meta
+              ) -> Iterator[tuple[Path, dict | None]]:
+    """
+    Yield (img, meta) in order, with metadata read by read_batch in
+    batches of batch_size spread over the workers of pool.
+    """
+    def read_chunk(et, etl, chunk):
+        return chunk, read_batch(et, etl, chunk, read)
+
+    for chunk, metas in pool.map(read_chunk, batched(imgs, batch_size)):
+        yield from zip(chunk, metas)
+
+
+def escape_newlines(tags: dict) -> dict:
+    """
+    Escape the newlines of the values of tags as the entity -escapeHTML
+    decodes, since exiftool reads its arguments one per line.
+    """
+    return {k: v.replace('\n', '&#x0a;') if isinstance(v, str) else v
+            for k, v in tags.items()}
+
+
+class TagWriter:
+    """
+    Buffer per-file patches and write the files sharing an identical
+    patch with one exiftool call, spreading the groups over pool.
+
+    add and flush return (img, payload, error) for every written file in
+    the order they were added; error is the ExifToolExecuteError of that
+    file or None. With -escapeHTML in params, the newlines of the values
+    are escaped.
+    """
+
+    def __init__(self, pool: ExifToolPool, params: list[str] = None,
+                 batch_size: int = 64):
+        self.pool = pool
+        self.params = params
+        self.batch_size = batch_size
+        self._escape = '-escapeHTML' in (params or [])
+        self._pending = []
+
+    def add(self, img: Path, tags: dict, payload=None) -> list[tuple]:
+        if self._escape:
+            tags = escape_newlines(tags)
+        self._pending.append((img, tags, payload))
+        if len(self._pending) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self) -> list[tuple]:
+        pending, self._pending = self._pending, []
+        groups = {}
+        for img, tags, _ in pending:
+            key = repr(sorted(tags.items()))
+            groups.setdefault(key, (tags, []))[1].append(img)
+        errors = {}
+        for e in self.pool.map(self._write, groups.values()):
+            errors |= e
+        return [(img, payload, errors.get(img))
+                for img, _, payload in pending]
+
+    def _write(self, et: ExifToolHelper, etl: ExifTool, group) -> dict:
+        tags, imgs = group
+        try:
+            with profile.span('exiftool.write'):
+                et.set_tags(imgs, tags, params=self.params)
+        except ExifToolExecuteError as e:
+            if len(imgs) == 1:
+                return {imgs[0]: e}
+            # exiftool does not tell which file failed, retry one by one
+            errors = {}
+            for img in imgs:
+                errors |= self._write(et, etl, (tags, [img]))
+            return errors
+        return {}
@@ -0,0 +1,69 @@
+"""
+Fast distances for location checks.
+
+Haversine on the mean Earth sphere is within 0.6% of the WGS-84
+geodesic, so it settles threshold checks on its own and the exact (and
+slow) geodesic is only solved for distances that close to a threshold.
+"""
+import math
+from typing import Iterable
+
+EARTH_RADIUS_KM = 6371.0088
+HAVERSINE_ERROR = 0.006
+
+# WGS-84
+_A = 6378137.0
+_E2 = 6.69437999014e-3
+
+
+def parse_point(point) -> tuple[float, float]:
+    """Accept (lat, lng) pairs as well as 'lat lng' or 'lat, lng'."""
+    if isinstance(point, str):
+        point = point.replace(',', ' ').split()
+    lat, lng = point
+    return float(lat), float(lng)
+
+
+def distance(point1, point2, thresholds: Iterable[float] = ()) -> float:
+    """
+    Distance in km between two points, exact when close enough to one of
+    thresholds for haversine to be ambiguous.
+    """
+    (lat1, lng1), (lat2, lng2) = parse_point(point1), parse_point(point2)
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2)
+         * math.sin((lng2 - lng1) / 2) ** 2)
+    dist = 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1)))
+    if any(abs(dist - t) <= t * HAVERSINE_ERROR for t in thresholds):
+        from geopy.distance import geodesic
+        dist = geodesic(parse_point(point1), parse_point(point2)).km
+    return dist
+
+
+def rounding_error(lat, lng, lat_, lng_) -> float:
+    """
+    Meters between (lat, lng) and a point a rounding away, from the local
+    radii of curvature of the ellipsoid.
+    """
+    phi = math.radians(lat)
+    w = 1 - _E2 * math.sin(phi) ** 2
+    meridian = _A * (1 - _E2) / w ** 1.5
+    normal = _A / math.sqrt(w)
+    return math.hypot(meridian * math.radians(lat_ - lat),
+                      normal * math.cos(phi) * math.radians(lng_ - lng))
+
+
+def round_precision(lat, lng, tolerance=0.01) -> tuple[int, float]:
+    """
+    Smallest number of decimals keeping (lat, lng) within tolerance
+    meters, with the error it leaves.
+    """
+    # a degree spans at most 111.7km, which bounds the precision needed
+    upper = max(1, math.ceil(math.log10(0.5 * 111_700 * math.sqrt(2)
+                                        / tolerance)))
+    for precision in range(1, upper + 1):
+        err = rounding_error(lat, lng, round(lat, precision),
+                             round(lng, precision))
+        if err < tolerance:
+            break
+    return precision, err
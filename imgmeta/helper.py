@@ -1,33 +1,123 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
 from typing import Iterator
 
-from geopy.distance import geodesic
+from rich.progress import Progress, TaskID
 
 from imgmeta import console
+from imgmeta.geo import distance
 
 
-def get_img_path(path: Path, skip_dir=None) -> Iterator[Path]:
-    media_ext = ('.jpg', '.mov', '.png', '.jpeg',
-                 '.mp4', '.gif', '.heic', '.webp')
-    files = []
-    paths = [path] if path.is_file() else path.iterdir()
-    for p in paths:
-        if any(part.startswith('.') for part in p.parts):
-            continue
-        elif p.is_file():
-            if not p.suffix.lower().endswith(media_ext):
+MEDIA_EXT = ('.jpg', '.mov', '.png', '.jpeg',
+             '.mp4', '.gif', '.heic', '.webp')
+HASH_BUFFER_SIZE = 8 * 2**20
+
+
+def _scan_dir(path: str, skip_dir=None) -> tuple[list[str], list[str]]:
+    dirs, files = [], []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name.startswith('.'):
                 continue
-            p_strip = p.parent/(p.name.lstrip())
-            if p != p_strip:
-                assert not p_strip.exists()
-                p = p.rename(p_strip)
-            files.append(p)
-        elif p.is_dir():
-            if skip_dir and skip_dir in p.stem:
+            elif entry.is_file():
+                if entry.name.lower().endswith(MEDIA_EXT):
+                    files.append(entry.path)
+            elif entry.is_dir():
+                if skip_dir and skip_dir in Path(entry.name).stem:
+                    continue
+                dirs.append(entry.path)
+    return dirs, sorted(files)
+
+
+def _strip_name(p: Path) -> Path:
+    p_strip = p.parent/(p.name.lstrip())
+    if p != p_strip:
+        assert not p_strip.exists()
+        p = p.rename(p_strip)
+    return p
+
+
+def get_img_path(path: Path, skip_dir=None, jobs: int = 1) -> Iterator[Path]:
+    """Stream the media files under path, listing ahead on jobs threads."""
+    if any(part.startswith('.') for part in path.parts):
+        return
+    if path.is_file():
+        if path.suffix.lower().endswith(MEDIA_EXT):
+            yield _strip_name(path)
+        return
+
+    executor = ThreadPoolExecutor(jobs) if jobs > 1 else None
+
+    def scan(d: str):
+        if not executor:
+            return _scan_dir(d, skip_dir)
+        dirs, files = d.result()
+        return [executor.submit(_scan_dir, s, skip_dir) for s in dirs], files
+
+    try:
+        root = executor.submit(_scan_dir, path, skip_dir) if executor else path
+        dirs, files = scan(root)
+        stack = [(iter(dirs), files)]
+        while stack:
+            dirs, files = stack[-1]
+            if (d := next(dirs, None)) is not None:
+                dirs, files = scan(d)
+                stack.append((iter(dirs), files))
                 continue
-            yield from get_img_path(p)
+            stack.pop()
+            for f in files:
+                yield _strip_name(Path(f))
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+
+
+def scan_img_path(paths: list[Path], progress: Progress, task: TaskID,
+                  skip_dir=None, jobs: int = 1) -> Iterator[Path]:
+    """
+    Walk paths ahead on a background thread and stream the media files
+    found, growing the total of task as they are discovered.
+
+    The caller advances task itself once a file has been dealt with.
+    """
+    found = queue.SimpleQueue()
+    done = object()
+
+    def walk():
+        try:
+            total = 0
+            for p in paths:
+                for img in get_img_path(p, skip_dir, jobs):
+                    found.put(img)
+                    progress.update(task, total=(total := total + 1))
+        except BaseException as e:
+            found.put(e)
+        found.put(done)
 
-    yield from sorted(files)
+    threading.Thread(target=walk, daemon=True).start()
+    while (img := found.get()) is not done:
+        if isinstance(img, BaseException):
+            raise img
+        yield img
+
+
+def hash_file(path, digest, copy_to=None) -> bytes:
+    """
+    Feed path to digest, a hashlib-like object, with large reads, copying
+    it to copy_to on the way if given, and return the digest.
+    """
+    buffer = memoryview(bytearray(HASH_BUFFER_SIZE))
+    with (open(path, 'rb') as f,
+          open(copy_to, 'wb') if copy_to else nullcontext() as out):
+        while n := f.readinto(buffer):
+            digest.update(buffer[:n])
+            if out:
+                out.write(buffer[:n])
+    return digest.digest()
 
 
 def diff_meta(modified: dict, original: dict):
@@ -36,7 +126,7 @@ def diff_meta(modified: dict, original: dict):
     for k, v in modified.items():
         if k in original:
             if (o := original[k]) != '':
-                if str(v) == str(o) or v == o:
+                if v == o or str(v) == str(o):
                     continue
         assert k in original or v
         if k.startswith('ICC_Profile'):
@@ -46,11 +136,22 @@ def diff_meta(modified: dict, original: dict):
     return to_write
 
 
+def diff_subset(to_write: dict, modified: dict,
+                original: dict) -> tuple[dict, dict]:
+    """The parts of modified and original show_diff needs for to_write."""
+    keys = set(to_write)
+    if 'XMP:Geography' in keys:
+        # show_diff reports the location a geography moved to
+        keys.add('XMP:Location')
+    return ({k: modified[k] for k in keys if k in modified},
+            {k: original[k] for k in keys if k in original})
+
+
 def show_diff(modified: dict, original: dict):
     assert set(modified).issuperset(original)
     for k, v in modified.items():
         if k in original:
-            if str(v) == str(original[k]) or v == original[k]:
+            if v == (o := original[k]) or str(v) == str(o):
                 continue
         assert k in original or v
         if v != '':
@@ -58,7 +159,7 @@ def show_diff(modified: dict, original: dict):
         if k in original:
             console.log(f'-{k}: {original[k]}', style='red')
         if k == 'XMP:Geography' and k in original:
-            dist = geodesic(original[k], v).kilometers
+            dist = distance(original[k], v, thresholds=[1, 20])
             location = modified["XMP:Location"]
             if dist > 20:
                 style = 'error'
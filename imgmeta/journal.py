@@ -0,0 +1,87 @@
+"""
+Write-ahead journals of in-place writes, for `imgmeta rollback`.
+
+A journal is JSON lines: {"file": ..., "tags": {tag: previous value}}
+for every file about to be written, '' standing for a tag it did not
+have, {"file": ..., "failed": true} when the write of the file then
+failed and {"file": ..., "moved_to": ...} once it was moved.
+"""
+import json
+import os
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterable
+
+
+class Journal:
+    """
+    Append the previous values of the tags about to be written to a
+    journal, which is flushed to disk before the files are overwritten.
+    Safe to share between threads.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._file = open(self.path, 'a', encoding='utf-8')
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+
+    def record(self, entries: Iterable[tuple[Path, dict]]):
+        """Record (img, previous tags) entries, before writing them."""
+        self._append({'file': str(img), 'tags': tags}
+                     for img, tags in entries)
+
+    def failed(self, imgs: Iterable[Path]):
+        """Mark the last entries of imgs as not written."""
+        self._append({'file': str(img), 'failed': True} for img in imgs)
+
+    def moved(self, src: Path, dst: Path):
+        """Record that src now lives at dst, for rollback to find it."""
+        self._append([{'file': str(src), 'moved_to': str(dst)}])
+
+    def _append(self, entries: Iterable[dict]):
+        lines = [json.dumps(e, ensure_ascii=False, default=str) + '\n'
+                 for e in entries]
+        if not lines:
+            return
+        with self._lock:
+            self._file.writelines(lines)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+
+def load_journal(path: Path) -> dict[str, dict]:
+    """
+    The tags to write back to each file of a journal to restore it as it
+    was before the first write recorded, by the path it was moved to last.
+    """
+    entries = defaultdict(list)
+    with path.open(encoding='utf-8') as f:
+        for line in f:
+            try:
+                e = json.loads(line)
+            except json.JSONDecodeError:
+                # torn by a crash while recording, so never written
+                continue
+            if moved_to := e.get('moved_to'):
+                if e['file'] in entries:
+                    entries[moved_to] += entries.pop(e['file'])
+            elif e.get('failed'):
+                entries[e['file']].pop()
+            else:
+                entries[e['file']].append(e['tags'])
+    restore = {}
+    for file, tags_list in entries.items():
+        tags = {}
+        for previous in reversed(tags_list):
+            tags |= previous
+        if tags:
+            restore[file] = tags
+    return restore
@@ -1,24 +1,129 @@
+import itertools
+import os
 import re
+from collections import defaultdict
+from functools import lru_cache
 from pathlib import Path
+from types import MappingProxyType
+from typing import Callable, Iterable
 
-import geopy.distance
 import pendulum
-import questionary
-from aweme.model import Artist as AweArtist
-from aweme.model import Post
-from insmeta.model import Artist as InstaArtist
-from insmeta.model import Insta
-from redbook.model import Artist as RedArtist
-from redbook.model import Note
-from sinaspider.model import Artist as WeiboArtist
-from sinaspider.model import Weibo, WeiboMissed
-from twimeta.model import Artist as TwiArtist
-from twimeta.model import Twitter
-
-from imgmeta import console
+
+from imgmeta import console, profile
+from imgmeta.exif import sidecar_path
+from imgmeta.geo import distance
 from imgmeta.model import Geolocation
 
 
+@lru_cache(maxsize=4096)
+def get_artist_info(supplier: str, user_id) -> MappingProxyType:
+    """
+    Resolve the xmp_info of the artist user_id of supplier, memoized for
+    the run since a folder holds a handful of artists; write_meta and
+    write_ins clear it when they start.
+    """
+    match supplier:
+        case 'weibo':
+            from sinaspider.model import Artist
+            info = Artist.from_id(user_id).xmp_info
+        case 'redbook':
+            from redbook.model import Artist
+            info = Artist.from_id(user_id).xmp_info
+        case 'aweme':
+            from aweme.model import Artist
+            info = Artist.from_id(user_id).xmp_info
+        case 'instagram':
+            from insmeta.model import Artist
+            info = Artist.from_id(user_id).meta
+        case 'twitter':
+            from twimeta.model import Artist
+            artist = Artist.from_id(user_id)
+            info = artist.xmp_info if artist else {}
+    return MappingProxyType(dict(info))
+
+
+_records = {}
+# keys queried by the last prefetch, found or not
+_prefetched = set()
+
+
+def _weibo_bid(unique_id: str) -> str:
+    from sinaspider.helper import encode_wb_id
+    if unique_id.isdigit():
+        unique_id = encode_wb_id(int(unique_id))
+    return unique_id
+
+
+def _insta_ids(unique_id, user_id, raw_filename):
+    from insmeta.model import get_id_from_filename
+    if unique_id:
+        unique_id = int(unique_id)
+        assert user_id
+    if user_id:
+        user_id = int(user_id)
+    if ids := get_id_from_filename(raw_filename):
+        assert not unique_id or unique_id == ids[0]
+        assert not user_id or user_id == ids[1]
+        unique_id, user_id = ids
+    return unique_id, user_id
+
+
+def _get_record(model, key, default: Callable, fetch: bool = False):
+    """
+    Return the record of model prefetched under key, None if the prefetch
+    did not find it, and the point lookup default() if it was not asked.
+
+    With fetch, default() fetches or fails on missing records rather than
+    returning None, so it is still called for those the prefetch missed.
+    """
+    if (record := _records.get((model, str(key)))) is not None:
+        return record
+    if (model, str(key)) in _prefetched and not fetch:
+        return
+    return default()
+
+
+@profile.timed('db.prefetch')
+def prefetch_records(metas: Iterable[dict]):
+    """
+    Load the supplier records gen_xmp_info will need for metas with one
+    IN query per table, replacing those of the previous batch.
+    """
+    ids = defaultdict(set)
+    for meta in metas:
+        supplier = meta.get('XMP:ImageSupplierName', '').lower()
+        unique_id = meta.get('XMP:ImageUniqueID')
+        match supplier:
+            case 'weibo' if unique_id:
+                from sinaspider.model import Weibo, WeiboMissed
+                ids[Weibo, Weibo.bid].add(_weibo_bid(unique_id))
+                ids[WeiboMissed, WeiboMissed.bid].add(_weibo_bid(unique_id))
+            case 'redbook' if unique_id:
+                from redbook.model import Note
+                ids[Note, Note._meta.primary_key].add(unique_id)
+            case 'aweme' if unique_id:
+                from aweme.model import Post
+                ids[Post, Post._meta.primary_key].add(unique_id)
+            case 'instagram':
+                from insmeta.model import Insta
+                raw_filename = (meta.get('XMP:RawFileName')
+                                or meta['File:FileName'])
+                unique_id, _ = _insta_ids(
+                    unique_id, meta.get('XMP:ImageSupplierID'), raw_filename)
+                if unique_id:
+                    ids[Insta, Insta._meta.primary_key].add(unique_id)
+            case 'twitter' if unique_id:
+                from twimeta.model import Twitter
+                ids[Twitter, Twitter.id].add(unique_id)
+    _records.clear()
+    _prefetched.clear()
+    for (model, field), keys in ids.items():
+        _prefetched.update((model, str(key)) for key in keys)
+        for record in model.select().where(field.in_(list(keys))):
+            _records[model, str(getattr(record, field.name))] = record
+
+
+@profile.timed('gen_xmp_info')
 def gen_xmp_info(meta) -> dict:
     supplier = meta.get('XMP:ImageSupplierName', '')
     user_id = meta.get('XMP:ImageSupplierID')
@@ -28,59 +133,63 @@ def gen_xmp_info(meta) -> dict:
     res = {}
     match supplier.lower():
         case 'weibo':
+            from sinaspider.model import Weibo, WeiboMissed
             if unique_id:
-                from sinaspider.helper import encode_wb_id
-                if unique_id.isdigit():
-                    unique_id = encode_wb_id(int(unique_id))
-                wb = Weibo.get_or_none(
-                    bid=unique_id) or WeiboMissed.get_or_none(bid=unique_id)
+                unique_id = _weibo_bid(unique_id)
+                wb = _get_record(
+                    Weibo, unique_id,
+                    lambda: Weibo.get_or_none(bid=unique_id)
+                ) or _get_record(
+                    WeiboMissed, unique_id,
+                    lambda: WeiboMissed.get_or_none(bid=unique_id))
                 if not wb:
                     console.log(f'{unique_id} not found', style='error')
                 else:
                     res |= wb.gen_meta(sn)
                     assert wb.user_id == user_id
             if user_id:
-                artist = WeiboArtist.from_id(user_id)
-                res |= artist.xmp_info
+                res |= get_artist_info('weibo', user_id)
         case 'redbook':
+            from redbook.model import Note
             if unique_id:
-                note = Note.get_by_id(unique_id)
+                note = _get_record(
+                    Note, unique_id, lambda: Note.get_by_id(unique_id),
+                    fetch=True)
                 res |= note.gen_meta(sn)
             if user_id:
-                artist = RedArtist.from_id(user_id)
-                res |= artist.xmp_info
+                res |= get_artist_info('redbook', user_id)
 
         case 'aweme':
+            from aweme.model import Post
             if unique_id:
-                post = Post.from_id(unique_id)
+                post = _get_record(
+                    Post, unique_id, lambda: Post.from_id(unique_id),
+                    fetch=True)
                 res |= post.gen_meta(sn)
             if user_id:
-                artist = AweArtist.from_id(user_id)
-                res |= artist.xmp_info
+                res |= get_artist_info('aweme', user_id)
 
         case 'instagram':
-            from insmeta.model import get_id_from_filename
-            if unique_id:
-                unique_id = int(unique_id)
-                assert user_id
-            if user_id:
-                user_id = int(user_id)
-            if ids := get_id_from_filename(raw_filename):
-                assert not unique_id or unique_id == ids[0]
-                assert not user_id or user_id == ids[1]
-                unique_id, user_id = ids
+            from insmeta.model import Insta
+            unique_id, user_id = _insta_ids(unique_id, user_id, raw_filename)
             if unique_id:
-                res |= Insta.from_id(unique_id, user_id).meta
+                insta = _get_record(Insta, unique_id,
+                                    lambda: Insta.from_id(unique_id, user_id),
+                                    fetch=True)
+                res |= insta.meta
             if user_id:
-                res |= InstaArtist.from_id(user_id).meta
+                res |= get_artist_info('instagram', user_id)
 
         case 'twitter':
+            from twimeta.model import Twitter
             user_id = meta.get('XMP:ImageCreatorName')
-            if unique_id and (twitter := Twitter.get_or_none(id=unique_id)):
+            if unique_id and (twitter := _get_record(
+                    Twitter, unique_id,
+                    lambda: Twitter.get_or_none(id=unique_id))):
                 res |= twitter.gen_meta(sn)
                 user_id = twitter.user_id
-            if user_id and (artist := TwiArtist.from_id(user_id)):
-                res |= artist.xmp_info
+            if user_id:
+                res |= get_artist_info('twitter', user_id)
 
     for v in res.values():
         if isinstance(v, str):
@@ -91,63 +200,187 @@ def gen_xmp_info(meta) -> dict:
     return res
 
 
+# the only tags rename_single_img and the rename commands look at
+RENAME_TAGS = ['XMP:RawFileName', 'XMP:Artist', 'XMP:ImageCreatorName',
+               'XMP:DateCreated', 'XMP:SeriesNumber', 'XMP:ImageSupplierID']
+
+
 def rename_single_img(img: Path, meta: dict, new_dir=False,
                       root=None, sep_mp4: bool = True,
                       sep_mov: bool = False,):
-    new_dir = new_dir or root or sep_mov or sep_mp4
-    raw_file_name = meta.get('XMP:RawFileName')
-    artist = meta.get('XMP:Artist') or meta.get(
-        'XMP:ImageCreatorName')
-    date = meta.get('XMP:DateCreated', '')
-    if not all([raw_file_name, artist, date]):
-        console.log(img)
-        return
-    fmt = 'YYYY:MM:DD HH:mm:ss.SSSSSS'
-    date = date.removesuffix('+08:00').removesuffix('.000000')
-    date = pendulum.from_format(date, fmt=fmt[:len(date)])
-    sn = meta.get('XMP:SeriesNumber')
-    inc = 0
-    mov = None
-    if sep_mov:
-        assert img.suffix != '.mov'
-        if (mov := img.with_suffix('.mov')).exists():
-            assert img.suffix == '.jpg'
-        else:
-            mov = None
-    while True:
-        filename = f'{artist}-{date:%y-%m-%d-%H%M}'
-        filename += f'-{int(sn):d}' if sn else ''
-        filename += f'-{inc:02d}' if inc else ''
-        if 'edited' in img.name:
-            filename += '_edited'
-        filename += img.suffix
+    planner = RenamePlanner()
+    planner.add(img, meta, new_dir, root, sep_mp4, sep_mov)
+    planner.run()
+
+
+class RenamePlanner:
+    """
+    Plan the renames of rename_single_img in memory and run them at once.
+
+    Every directory involved is listed once into a case-insensitive index
+    in which names are taken and freed as moves are planned, in order, so
+    that the -NN increment is found without a stat per try. Each move is
+    planned onto a name free at its turn, which keeps the plan free of
+    conflicts and cycles when run in order.
+    """
+
+    def __init__(self):
+        self._names: dict[str, dict[str, str]] = {}
+        # (img, img_new, inc, mov, mov_new)
+        self.moves: list[tuple] = []
+
+    def _index(self, path: Path) -> dict[str, str]:
+        key = os.path.abspath(path)
+        if (names := self._names.get(key)) is None:
+            try:
+                names = {n.casefold(): n for n in os.listdir(path)}
+            except FileNotFoundError:
+                names = {}
+            self._names[key] = names
+        return names
+
+    def _lookup(self, path: Path) -> Path | None:
+        if name := self._index(path.parent).get(path.name.casefold()):
+            return path.parent / name
+
+    def _move(self, src: Path, dst: Path):
+        del self._index(src.parent)[src.name.casefold()]
+        self._index(dst.parent)[dst.name.casefold()] = dst.name
+
+    def _move_with_sidecar(self, src: Path, dst: Path):
+        self._move(src, dst)
+        if xmp := self._lookup(sidecar_path(src)):
+            self._move(xmp, sidecar_path(dst))
+
+    def add(self, img: Path, meta: dict, new_dir=False,
+            root=None, sep_mp4: bool = True,
+            sep_mov: bool = False) -> Path | None:
+        """Plan the rename of img, returning its new path."""
+        new_dir = new_dir or root or sep_mov or sep_mp4
+        raw_file_name = meta.get('XMP:RawFileName')
+        artist = meta.get('XMP:Artist') or meta.get(
+            'XMP:ImageCreatorName')
+        date = meta.get('XMP:DateCreated', '')
+        if not all([raw_file_name, artist, date]):
+            console.log(img)
+            return
+        fmt = 'YYYY:MM:DD HH:mm:ss.SSSSSS'
+        date = date.removesuffix('+08:00').removesuffix('.000000')
+        date = pendulum.from_format(date, fmt=fmt[:len(date)])
+        sn = meta.get('XMP:SeriesNumber')
+        mov = None
+        if sep_mov:
+            assert img.suffix != '.mov'
+            if mov := self._lookup(img.with_suffix('.mov')):
+                assert img.suffix == '.jpg'
+        stem = f'{artist}-{date:%y-%m-%d-%H%M}'
+        stem += f'-{int(sn):d}' if sn else ''
+        suffix = '_edited' if 'edited' in img.name else ''
+        suffix += img.suffix
         if new_dir:
             if mov:
                 subfolder = '_mov'
-            elif sep_mp4 and filename.endswith('.mp4'):
+            elif sep_mp4 and suffix.endswith('.mp4'):
                 subfolder = '_mp4'
             else:
                 subfolder = artist
             path = Path(root)/subfolder if root else Path(subfolder)
-            path.mkdir(exist_ok=True, parents=True)
         else:
             path = img.parent
-        img_new = path / filename
-
-        if img_new == img:
-            break
-        elif img_new.exists():
-            inc += 1
-        else:
-            img.rename(img_new)
-            if mov:
-                mov_new = img_new.with_suffix('.mov')
-                assert not mov_new.exists()
-                mov.rename(mov_new)
+        names = self._index(path)
+        for inc in itertools.count():
+            filename = stem + (f'-{inc:02d}' if inc else '') + suffix
+            img_new = path / filename
+            if img_new == img:
+                return img
+            # a sidecar left at the target would be read as its own
+            elif not ({filename.casefold(),
+                       sidecar_path(filename).name.casefold()} & names.keys()):
+                break
+        self._move_with_sidecar(img, img_new)
+        mov_new = None
+        if mov:
+            mov_new = img_new.with_suffix('.mov')
+            assert not (self._lookup(mov_new)
+                        or self._lookup(sidecar_path(mov_new)))
+            self._move_with_sidecar(mov, mov_new)
+        self.moves.append((img, img_new, inc, mov, mov_new))
+        return img_new
+
+    def run(self, dry_run=False):
+        made = set()
+        for img, img_new, inc, mov, mov_new in self.moves:
+            if dry_run:
+                console.log(f'would move {img} to {img_new}')
+                continue
+            if img_new.parent not in made:
+                img_new.parent.mkdir(exist_ok=True, parents=True)
+                made.add(img_new.parent)
+            # the plan only knows of the files there when it was made
+            for src, dst in [(img, img_new), (mov, mov_new)]:
+                if not src:
+                    continue
+                assert not dst.exists()
+                src.rename(dst)
+                if (xmp := sidecar_path(src)).exists():
+                    xmp_new = sidecar_path(dst)
+                    assert not xmp_new.exists()
+                    xmp.rename(xmp_new)
             console.log(f'move {img} to {img_new}')
             if inc:
-                console.log(f'inc: {inc} is used for {img_new}', style='error')
-            break
+                console.log(
+                    f'inc: {inc} is used for {img_new}', style='error')
+        self.moves.clear()
+
+
+# (src_tag, dst_tag): the value of the tags ending with src_tag goes to
+# dst_tag, in this order
+MOVE_RULES = (
+    (':BaseURL', 'XMP:BlogURL'),
+    (':ImageDescription', 'XMP:Description'),
+    ('IPTC:Keywords', 'XMP:Subject'),
+    (':Artist', 'XMP:Artist'),
+    (':Source', 'XMP:Source'),
+    (':UserComment', 'XMP:UserComment'),
+    (':ImageUnique', 'XMP:ImageUniqueID'),
+    ('EXIF:CreateDate', 'XMP:DateCreated'),
+    ('XMP:CreateDate', 'XMP:DateCreated'),
+    ('QuickTime:CreateDate', 'XMP:DateCreated'),
+    (':Title', 'XMP:Title'),
+    (':Description', 'XMP:Description'),
+    # ('Keys:GPSCoordinates', 'XMP:Geography'),
+    ('QuickTime:Keywords', 'XMP:Subject'),
+)
+MP4_COPY_RULES = (
+    ('XMP:DateCreated', 'QuickTime:CreateDate'),
+    ('XMP:Title', 'QuickTime:Title'),
+    ('XMP:Description', 'QuickTime:Description'),
+    ('XMP:Geography', 'Keys:GPSCoordinates'),
+    ('XMP:Subject', 'QuickTime:Keywords'),
+)
+
+
+class TagIndex:
+    """
+    The keys of a meta by tag name, the part after the last colon.
+
+    A key ending with a tag that has a colon shares its name, so the keys
+    ending with it are found among a handful of keys rather than all.
+    Keys added to the meta afterwards must be added to the index too.
+    """
+
+    def __init__(self, keys: Iterable[str]):
+        self._keys = defaultdict(list)
+        for key in keys:
+            self.add(key)
+
+    def add(self, key: str):
+        self._keys[key.rpartition(':')[2]].append(key)
+
+    def ending_with(self, tag: str) -> list[str]:
+        assert ':' in tag
+        return [k for k in self._keys.get(tag.rpartition(':')[2], ())
+                if k.endswith(tag)]
 
 
 class ImageMetaUpdate:
@@ -158,6 +391,7 @@ class ImageMetaUpdate:
         self.filename = meta['File:FileName']
         self.filepath = meta['SourceFile']
 
+    @profile.timed('process_meta')
     def process_meta(self):
         if ',' in self.meta.get('QuickTime:Keywords', ''):
             self.meta['QuickTime:Keywords'] = self.meta[
@@ -249,7 +483,7 @@ class ImageMetaUpdate:
         if composite:
             if not geography:
                 return
-            if (dist := geopy.distance.distance(composite, geography).km) > 1:
+            if (dist := distance(composite, geography, thresholds=[1])) > 1:
                 console.log(
                     f'{self.filepath}: distance between {composite} and {geography} is {dist}km',
                     style='warning')
@@ -262,36 +496,16 @@ class ImageMetaUpdate:
         self.meta['XMP:Geography'] = f'{lat} {lng}'
 
     def move_meta(self):
-        tuple_tag_to_move = [
-            (':BaseURL', 'XMP:BlogURL'),
-            (':ImageDescription', 'XMP:Description'),
-            ('IPTC:Keywords', 'XMP:Subject'),
-            (':Artist', 'XMP:Artist'),
-            (':Source', 'XMP:Source'),
-            (':UserComment', 'XMP:UserComment'),
-            (':ImageUnique', 'XMP:ImageUniqueID'),
-            ('EXIF:CreateDate', 'XMP:DateCreated'),
-            ('XMP:CreateDate', 'XMP:DateCreated'),
-            ('QuickTime:CreateDate', 'XMP:DateCreated'),
-            (':Title', 'XMP:Title'),
-            (':Description', 'XMP:Description'),
-            # ('Keys:GPSCoordinates', 'XMP:Geography'),
-            ('QuickTime:Keywords', 'XMP:Subject')
-        ]
-        for src_tag, dst_tag in tuple_tag_to_move:
-            self.transfer_tag(src_tag, dst_tag)
+        index = TagIndex(self.meta)
+        for src_tag, dst_tag in MOVE_RULES:
+            self.transfer_tag(src_tag, dst_tag, index=index)
 
     def copy_meta(self):
-        mp4_tag_to_copy = [
-            ('XMP:DateCreated', 'QuickTime:CreateDate'),
-            ('XMP:Title', 'QuickTime:Title'),
-            ('XMP:Description', 'QuickTime:Description'),
-            ('XMP:Geography', 'Keys:GPSCoordinates'),
-            ('XMP:Subject', 'QuickTime:Keywords')
-        ]
         if self.meta['File:MIMEType'] in ['video/mp4', 'video/quicktime']:
-            for src_tag, dst_tag in mp4_tag_to_copy:
-                self.transfer_tag(src_tag, dst_tag, is_move=False)
+            index = TagIndex(self.meta)
+            for src_tag, dst_tag in MP4_COPY_RULES:
+                self.transfer_tag(src_tag, dst_tag, is_move=False,
+                                  index=index)
             create_date = self.meta['QuickTime:CreateDate']
             if create_date == self.meta['XMP:DateCreated']:
                 assert not create_date.endswith('+08:00')
@@ -326,6 +540,7 @@ class ImageMetaUpdate:
                 return
             console.log(
                 f'[u b]{self.filepath}  {tag_aux}[/u b]: discard {v_aux}?')
+            import questionary
             if questionary.confirm('discard or not').unsafe_ask():
                 v_aux = ''
             else:
@@ -343,6 +558,7 @@ class ImageMetaUpdate:
             elif self.prompt:
                 console.log(
                     f'[u b]{self.filepath}  {tag}[/u b]: discard {v}?')
+                import questionary
                 if questionary.confirm('discard or not').unsafe_ask():
                     self.meta.update(to_update)
             return
@@ -364,14 +580,25 @@ class ImageMetaUpdate:
             console.log(
                 f'[u b]{self.filepath}  {tag}[/u b]: discard '
                 f'[b red]{v}[/b red] and write [b red]{value} ?[/b red]')
+            import questionary
             if questionary.confirm('discard or not').unsafe_ask():
                 self.meta.update(to_update)
 
-    def transfer_tag(self, src_tag, dst_tag, is_move=True):
+    def transfer_tag(self, src_tag, dst_tag, is_move=True,
+                     index: TagIndex = None):
+        """
+        With index, the keys ending with src_tag are looked up in it
+        instead of scanned for, and it is kept up to date.
+        """
         assert (src_tag != dst_tag)
-        src_meta = {k:  v if isinstance(v, list) else str(v) for k, v in
-                    self.meta.items() if k.endswith(src_tag)
-                    and k != dst_tag and v != ''}
+        if index is None:
+            keys = [k for k in self.meta if k.endswith(src_tag)]
+        else:
+            keys = index.ending_with(src_tag)
+        src_meta = {}
+        for k in keys:
+            if k != dst_tag and (v := self.meta[k]) != '':
+                src_meta[k] = v if isinstance(v, list) else str(v)
         if not (src_values := list(src_meta.values())):
             return
         src_value = src_values[0]
@@ -399,6 +626,7 @@ class ImageMetaUpdate:
                     return
                 console.print(f'[b u]{self.filepath} {dst_tag}[/b u]: '
                               'conflict value found')
+                import questionary
                 src_value = questionary.select(
                     'which one you want to keep',
                     choices=[src_value, dst_value],
@@ -407,6 +635,8 @@ class ImageMetaUpdate:
 
         if is_move:
             dst_update |= {k: '' for k in src_meta}
+        if index is not None and dst_tag not in self.meta:
+            index.add(dst_tag)
         self.meta.update(dst_update)
 
     @staticmethod
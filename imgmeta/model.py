@@ -1,22 +1,83 @@
-import itertools
+import os
+import threading
 import time
-from time import sleep
-from typing import Self
-
-import keyring
-from geopy import geocoders
-from geopy.distance import geodesic
-from peewee import DoubleField, Model, TextField
-from playhouse.postgres_ext import PostgresqlExtDatabase
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Iterable, Self
+
+from peewee import (DateTimeField, DoubleField, Model, PostgresqlDatabase,
+                    TextField)
+from playhouse.postgres_ext import PooledPostgresqlExtDatabase
 from playhouse.shortcuts import model_to_dict
 
-from imgmeta import console
+from imgmeta import console, profile
+from imgmeta.geo import round_precision
+
+
+class TokenBucket:
+    """Allow rate calls per second on average, in bursts up to capacity."""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+def forget_connections(db: PooledPostgresqlExtDatabase):
+    """
+    Drop the pooled connections of db inherited by a forked child without
+    closing them, as closing would end the session of the parent too.
+    """
+    db._lock = threading.RLock()
+    db._pool_lock = threading.RLock()
+    db._pool_available = threading.Condition(db._pool_lock)
+    db._connections = []
+    db._in_use = {}
+    db._state.reset()
 
 
 class BaseModel(Model):
     class Meta:
-        database = PostgresqlExtDatabase(
-            'imgmeta', host='localhost', autorollback=True)
+        # every thread checks out a connection of its own
+        database = PooledPostgresqlExtDatabase(
+            'imgmeta', host='localhost', autorollback=True,
+            max_connections=32, stale_timeout=600, timeout=60)
+
+    @classmethod
+    @contextmanager
+    def session(cls, read_only: bool = False):
+        """
+        Hold a connection for the block, given back to the pool after it
+        unless the thread had one already. A read-only session is a
+        single read-only transaction.
+        """
+        db = cls._meta.database
+        opened = db.is_closed() and db.connect()
+        try:
+            if not read_only:
+                yield
+                return
+            with db.atomic():
+                if isinstance(db, PostgresqlDatabase):
+                    db.execute_sql('SET TRANSACTION READ ONLY')
+                yield
+        finally:
+            if opened:
+                db.close()
 
     def __str__(self):
         model = model_to_dict(self, recurse=False)
@@ -24,42 +85,127 @@ class BaseModel(Model):
                          if v is not None)
 
 
+os.register_at_fork(
+    after_in_child=lambda: forget_connections(BaseModel._meta.database))
+
+
+class GeolocationMissed(BaseModel):
+    query = TextField(primary_key=True)
+    searched_at = DateTimeField(default=datetime.now)
+
+    ttl = timedelta(days=30)
+
+
 class Geolocation(BaseModel):
     query = TextField(primary_key=True)
     address = TextField()
     longitude = DoubleField()
     latitude = DoubleField()
 
-    _addr_not_found = set()
-    locator = geocoders.GoogleV3(
-        api_key=keyring.get_password("google_map", "api_key"))
+    # anything with a geopy-like geocode(query, language=...) will do,
+    # built on first use when left as None
+    locator = None
+    rate_limiter = TokenBucket(rate=1.0)
+
+    _loaded = False
+    _addrs: dict[str, Self] = {}
+    _addr_not_found: set[str] = set()
+    _pending: dict[str, Future] = {}
+    _lock = threading.Lock()
+    _executor = ThreadPoolExecutor(4, thread_name_prefix='geocode')
+
+    @classmethod
+    def get_locator(cls):
+        if cls.locator is None:
+            import keyring
+            from geopy import geocoders
+            cls.locator = geocoders.GoogleV3(
+                api_key=keyring.get_password("google_map", "api_key"))
+        return cls.locator
+
+    @classmethod
+    def preload(cls):
+        """Load all known queries and the unexpired misses at once."""
+        with cls._lock:
+            if cls._loaded:
+                return
+            with cls.session():
+                GeolocationMissed.create_table(safe=True)
+                with cls.session(read_only=True):
+                    cls._addrs = {addr.query: addr for addr in cls.select()}
+                    since = datetime.now() - GeolocationMissed.ttl
+                    cls._addr_not_found = {
+                        miss.query for miss in GeolocationMissed.select(
+                        ).where(GeolocationMissed.searched_at > since)}
+            cls._loaded = True
+
+    @classmethod
+    def prefetch(cls, queries: Iterable[str]):
+        """Start geocoding the unknown queries in the background."""
+        cls.preload()
+        for query in set(queries):
+            cls._submit(query)
 
     @classmethod
     def get_addr(cls, query) -> Self | None:
+        cls.preload()
+        if future := cls._submit(query):
+            return future.result()
+        return cls._addrs.get(query)
+
+    @classmethod
+    def _submit(cls, query) -> Future | None:
+        with cls._lock:
+            if query in cls._addrs or query in cls._addr_not_found:
+                return
+            if not (future := cls._pending.get(query)):
+                future = cls._executor.submit(cls._geocode, query)
+                cls._pending[query] = future
+            return future
+
+    @classmethod
+    def _geocode(cls, query) -> Self | None:
+        try:
+            with cls.session():
+                addr = cls._lookup(query)
+        except BaseException:
+            with cls._lock:
+                del cls._pending[query]
+            raise
+        with cls._lock:
+            if addr:
+                cls._addrs[query] = addr
+            else:
+                cls._addr_not_found.add(query)
+            del cls._pending[query]
+        return addr
+
+    @classmethod
+    def _lookup(cls, query) -> Self | None:
         if addr := Geolocation.get_or_none(query=query):
             return addr
-        elif query in cls._addr_not_found:
-            return
-        if not (addr := cls.locator.geocode(query, language='zh')):
-            cls._addr_not_found.add(query)
-            time.sleep(1)
+        with profile.span('geocode.wait'):
+            cls.rate_limiter.acquire()
+        profile.count('geocoder.calls')
+        with profile.span('geocode'):
+            addr = cls.get_locator().geocode(query, language='zh')
+        if not addr:
+            GeolocationMissed.insert(query=query).on_conflict(
+                conflict_target=[GeolocationMissed.query],
+                preserve=[GeolocationMissed.searched_at]).execute()
             return
         console.log(f'\nwrite geo_info: {query, addr.address}\n')
         lat, lng = cls.round_loc(addr.latitude, addr.longitude)
-        addr = Geolocation.create(
+        return Geolocation.create(
             query=query,
             address=addr.address,
             latitude=lat,
             longitude=lng)
-        sleep(1.0)
-        return addr
 
     @staticmethod
     def round_loc(lat, lng, tolerance=0.01):
-        for precision in itertools.count(start=1):
-            lat_, lng_ = round(lat, precision), round(lng, precision)
-            if (err := geodesic((lat, lng), (lat_, lng_)).meters) < tolerance:
-                break
+        precision, err = round_precision(lat, lng, tolerance)
+        lat_, lng_ = round(lat, precision), round(lng, precision)
         if err:
             console.log(
                 f'round loction: {lat, lng} -> {lat_, lng_}'
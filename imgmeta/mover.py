@@ -0,0 +1,95 @@
+"""
+Move files between folders and volumes.
+"""
+import hashlib
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+from imgmeta.helper import hash_file
+
+
+class Mover:
+    """
+    Move files without ever overwriting one.
+
+    A move within a filesystem is a rename, done at once; a move across
+    filesystems is a copy into a hidden .part file next to the target,
+    renamed into place once complete and then followed by the removal of
+    the source, run on up to jobs threads with at most twice as many
+    copies queued, so that move() blocks rather than letting the queue
+    grow past the copying. With verify, the copy is read
+    back and compared with the source before the source is removed.
+
+    Errors of the copies are raised by wait(), which the context manager
+    calls on exit. on_moved(src, dst) is called once each file is at dst,
+    from the copying threads for copies.
+    """
+
+    def __init__(self, jobs: int = 4, verify: bool = False,
+                 on_moved: Callable[[Path, Path], None] = None):
+        self.verify = verify
+        self.on_moved = on_moved
+        self._limit = 2 * jobs
+        self._executor = ThreadPoolExecutor(jobs)
+        self._devices = {}
+        self._futures = deque()
+        self._targets = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if not exc[0]:
+                self.wait()
+        finally:
+            self._executor.shutdown(cancel_futures=bool(exc[0]))
+
+    def _device(self, folder: Path) -> int:
+        if (dev := self._devices.get(folder)) is None:
+            folder.mkdir(parents=True, exist_ok=True)
+            dev = self._devices[folder] = os.stat(folder).st_dev
+        return dev
+
+    def move(self, src: Path, dst: Path):
+        """Move src to dst, creating its folder; dst must not exist."""
+        assert not dst.exists() and dst not in self._targets
+        if os.stat(src).st_dev == self._device(dst.parent):
+            os.rename(src, dst)
+            if self.on_moved:
+                self.on_moved(src, dst)
+        else:
+            while len(self._futures) >= self._limit:
+                self._targets.discard(self._futures.popleft().result())
+            self._targets.add(dst)
+            self._futures.append(self._executor.submit(self._copy, src, dst))
+
+    def _copy(self, src: Path, dst: Path):
+        part = dst.with_name(f'.{dst.name}.part')
+        try:
+            if self.verify:
+                digest = hash_file(src, hashlib.blake2b(), copy_to=part)
+                if hash_file(part, hashlib.blake2b()) != digest:
+                    raise OSError(f'copy of {src} to {part} is corrupted')
+            else:
+                shutil.copyfile(src, part)
+            shutil.copystat(src, part)
+            if dst.exists():
+                raise FileExistsError(dst)
+            os.rename(part, dst)
+        except BaseException:
+            part.unlink(missing_ok=True)
+            raise
+        if self.on_moved:
+            self.on_moved(src, dst)
+        os.unlink(src)
+        return dst
+
+    def wait(self):
+        """Wait for the copies in flight, raising the first error."""
+        while self._futures:
+            self._targets.discard(self._futures.popleft().result())
@@ -0,0 +1,172 @@
+"""
+Staged pipelines: items flow from a source through blocking stage
+functions running concurrently, connected by bounded queues.
+"""
+import asyncio
+import itertools
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator
+
+from imgmeta import profile
+
+_DONE = object()
+
+
+class _Call:
+    """A stage function call to be run by the thread iterating."""
+
+    def __init__(self, func: Callable, item):
+        self.func = func
+        self.item = item
+        self.future = Future()
+
+    def run(self):
+        try:
+            self.future.set_result(self.func(self.item))
+        except BaseException as e:
+            self.future.set_exception(e)
+
+
+class _Failure:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+class Pipeline:
+    """
+    Feed the items of source through stages and yield the results of the
+    last one in source order.
+
+    Every stage calls its function on up to `workers` threads at once and
+    is connected to the next by a queue of at most maxsize items, so that
+    a slow stage holds back the ones before it instead of piling up
+    results. The stages are driven by an asyncio loop on a background
+    thread; a stage added with main_thread=True calls its function on
+    the thread iterating the pipeline, for code that prompts the user.
+
+    An exception raised by a stage function stops the pipeline and is
+    raised by the iteration; leaving the iteration early stops the
+    pipeline once the calls in flight return.
+    """
+
+    def __init__(self, source: Iterable, maxsize: int = 2):
+        assert maxsize >= 1
+        self.source = source
+        self.maxsize = maxsize
+        self.stages = []
+        self._stop = threading.Event()
+
+    def stage(self, func: Callable, workers: int = 1,
+              main_thread: bool = False, name: str = None) -> 'Pipeline':
+        assert workers >= 1 and not (main_thread and workers > 1)
+        name = name or getattr(func, '__name__', None) or func.func.__name__
+        self.stages.append((profile.timed(f'stage.{name}')(func),
+                            workers, main_thread))
+        return self
+
+    def __iter__(self) -> Iterator:
+        out = queue.Queue(self.maxsize)
+        self._stop.clear()
+        loop = asyncio.new_event_loop()
+        task = loop.create_task(self._run(out))
+
+        def run_loop():
+            try:
+                loop.run_until_complete(task)
+            except asyncio.CancelledError:
+                pass
+            finally:
+                loop.close()
+
+        thread = threading.Thread(target=run_loop, daemon=True)
+        thread.start()
+        try:
+            while (item := out.get()) is not _DONE:
+                if isinstance(item, _Call):
+                    item.run()
+                elif isinstance(item, _Failure):
+                    raise item.exc
+                else:
+                    yield item
+        finally:
+            self._stop.set()
+            if thread.is_alive():
+                loop.call_soon_threadsafe(task.cancel)
+            thread.join()
+
+    def _put(self, out: queue.Queue, item):
+        while not self._stop.is_set():
+            try:
+                return out.put(item, timeout=0.1)
+            except queue.Full:
+                pass
+
+    async def _run(self, out: queue.Queue):
+        loop = asyncio.get_running_loop()
+        # a thread per stage worker, plus the source and the output
+        executor = ThreadPoolExecutor(
+            sum(workers for _, workers, _ in self.stages) + 2)
+        # stage i reads inputs[i] in source order and writes its results
+        # to outputs[i] in completion order, reordered into inputs[i + 1]
+        inputs = [asyncio.Queue(self.maxsize) for _ in self.stages]
+        outputs = [asyncio.Queue(self.maxsize) for _ in self.stages]
+        inputs.append(asyncio.Queue(self.maxsize))
+
+        def call(func, *args):
+            return loop.run_in_executor(executor, func, *args)
+
+        async def feed():
+            it = iter(self.source)
+            for seq in itertools.count():
+                if (item := await call(next, it, _DONE)) is _DONE:
+                    break
+                await inputs[0].put((seq, item))
+            await inputs[0].put(None)
+
+        running = [workers for _, workers, _ in self.stages]
+
+        async def work(i, func, main_thread):
+            while (entry := await inputs[i].get()) is not None:
+                seq, item = entry
+                if main_thread:
+                    await call(self._put, out, request := _Call(func, item))
+                    result = await asyncio.wrap_future(request.future)
+                else:
+                    result = await call(func, item)
+                await outputs[i].put((seq, result))
+            # let the other workers of the stage see the end too
+            await inputs[i].put(None)
+            running[i] -= 1
+            if not running[i]:
+                await outputs[i].put(None)
+
+        async def reorder(i):
+            pending, seq = {}, 0
+            while (entry := await outputs[i].get()) is not None:
+                pending[entry[0]] = entry[1]
+                while seq in pending:
+                    await inputs[i + 1].put((seq, pending.pop(seq)))
+                    seq += 1
+            await inputs[i + 1].put(None)
+
+        async def emit():
+            while (entry := await inputs[-1].get()) is not None:
+                await call(self._put, out, entry[1])
+
+        result = _DONE
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(feed())
+                for i, (func, workers, main_thread) in enumerate(
+                        self.stages):
+                    for _ in range(workers):
+                        tg.create_task(work(i, func, main_thread))
+                    tg.create_task(reorder(i))
+                tg.create_task(emit())
+        except* Exception as eg:
+            result = _Failure(eg.exceptions[0])
+        finally:
+            executor.shutdown(cancel_futures=True)
+        self._put(out, result)
@@ -0,0 +1,85 @@
+"""
+Write plans: the per-file patches of write_meta computed ahead of time,
+stored as JSON lines, and applied later in bulk.
+"""
+import json
+import os
+from multiprocessing.util import Finalize
+from pathlib import Path
+from typing import Iterator
+
+from exiftool import ExifTool, ExifToolHelper
+from exiftool.exceptions import ExifToolExecuteError
+
+from imgmeta.exif import get_meta
+from imgmeta.helper import diff_meta, diff_subset
+from imgmeta.meta import ImageMetaUpdate, prefetch_records
+
+_worker = None
+
+
+def init_worker():
+    """Start the exiftool processes of a plan worker process."""
+    global _worker
+    et, etl = ExifToolHelper(), ExifTool(common_args=['-G1', '-n'])
+    et.run()
+    etl.run()
+    _worker = et, etl
+    # workers leave through os._exit, past atexit but not finalizers
+    Finalize(None, et.terminate, exitpriority=10)
+    Finalize(None, etl.terminate, exitpriority=10)
+
+
+def plan_entry(img: Path, xmp_info: dict, meta: dict, to_write: dict) -> dict:
+    modified, original = diff_subset(to_write, xmp_info, meta)
+    st = os.stat(img)
+    return {
+        'file': str(img),
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'to_write': to_write,
+        'modified': modified,
+        'original': original,
+    }
+
+
+def plan_chunk(imgs: list[str], time_fix: bool = False) -> list[dict]:
+    """Read and process imgs on this worker, returning their entries."""
+    imgs = [Path(img) for img in imgs]
+    try:
+        metas = get_meta(*_worker, imgs)
+    except ExifToolExecuteError:
+        metas = [None] * len(imgs)
+    prefetch_records(meta for meta in metas if meta)
+    entries = []
+    for img, meta in zip(imgs, metas):
+        try:
+            meta = meta or get_meta(*_worker, [img])[0]
+        except ExifToolExecuteError as e:
+            entries.append({'file': str(img), 'error': str(e),
+                            'stderr': e.stderr})
+            continue
+        xmp_info = ImageMetaUpdate(meta, time_fix=time_fix).process_meta()
+        if to_write := diff_meta(xmp_info, meta):
+            entries.append(plan_entry(img, xmp_info, meta, to_write))
+    return entries
+
+
+def dump_entry(entry: dict) -> str:
+    return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def load_plan(plan: Path) -> Iterator[dict]:
+    with plan.open() as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def is_stale(entry: dict) -> bool:
+    """Whether the file changed since its entry was planned."""
+    try:
+        st = os.stat(entry['file'])
+    except FileNotFoundError:
+        return True
+    return (st.st_size, st.st_mtime_ns) != (entry['size'], entry['mtime_ns'])
@@ -0,0 +1,173 @@
+"""
+Timing spans and counters for `imgmeta --profile`.
+
+Nothing is recorded until enable() is called: span() then hands out a
+shared no-op context manager and count() returns at once.
+"""
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from pathlib import Path
+
+from rich.table import Table
+
+enabled = False
+_lock = threading.Lock()
+_spans: dict[str, list[float]] = defaultdict(list)
+_counters: dict[str, int] = defaultdict(int)
+_null = nullcontext()
+
+# upper bounds in seconds of the histogram buckets
+BUCKETS = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, math.inf]
+
+
+def enable():
+    global enabled
+    enabled = True
+    _hook_peewee()
+
+
+def span(name: str):
+    """Time the enclosed block under name."""
+    if not enabled:
+        return _null
+    return _span(name)
+
+
+@contextmanager
+def _span(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            _spans[name].append(elapsed)
+
+
+def timed(name: str):
+    """Decorator timing every call of the function under name."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with _span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str, n: int = 1):
+    if enabled:
+        with _lock:
+            _counters[name] += n
+
+
+def _hook_peewee():
+    """
+    Count and time every query of every peewee database, and the waits
+    for a connection of the pooled ones.
+    """
+    from peewee import Database
+    from playhouse.pool import PooledDatabase
+    if hasattr(Database.execute_sql, '__wrapped__'):
+        return
+
+    execute_sql = Database.execute_sql
+    connect = PooledDatabase.connect
+
+    @wraps(execute_sql)
+    def wrapper(self, *args, **kwargs):
+        count('db.queries')
+        with span('db.query'):
+            return execute_sql(self, *args, **kwargs)
+
+    @wraps(connect)
+    def connect_wrapper(self, *args, **kwargs):
+        with span('db.pool.wait'):
+            return connect(self, *args, **kwargs)
+    Database.execute_sql = wrapper
+    PooledDatabase.connect = connect_wrapper
+
+
+def _percentile(values: list[float], p: float) -> float:
+    return values[min(len(values) - 1, round(p / 100 * (len(values) - 1)))]
+
+
+def _histogram(values: list[float]) -> list[int]:
+    counts = [0] * len(BUCKETS)
+    for v in values:
+        counts[next(i for i, b in enumerate(BUCKETS) if v <= b)] += 1
+    return counts
+
+
+def summary() -> dict:
+    with _lock:
+        spans = {k: sorted(v) for k, v in _spans.items()}
+        counters = dict(_counters)
+    return {
+        'spans': {name: {
+            'calls': len(values),
+            'total_s': sum(values),
+            'p50_s': _percentile(values, 50),
+            'p99_s': _percentile(values, 99),
+            'max_s': values[-1],
+            'histogram': _histogram(values),
+        } for name, values in spans.items()},
+        'counters': counters,
+    }
+
+
+def report(console):
+    """Print the spans, slowest first, with their histograms."""
+    stats = summary()
+    bars = ' ▁▂▃▄▅▆▇█'
+    table = Table(title='profile', title_justify='left')
+    table.add_column('span', no_wrap=True)
+    for column in ['calls', 'total', 'mean', 'p50', 'p99', 'max']:
+        table.add_column(column, justify='right')
+    table.add_column('100us ... 5s+', no_wrap=True)
+    for name, s in sorted(stats['spans'].items(),
+                          key=lambda x: -x[1]['total_s']):
+        peak = max(s['histogram'])
+        table.add_row(
+            name, str(s['calls']), f"{s['total_s']:.2f}s",
+            f"{s['total_s'] / s['calls'] * 1000:.2f}ms",
+            f"{s['p50_s'] * 1000:.2f}ms", f"{s['p99_s'] * 1000:.2f}ms",
+            f"{s['max_s'] * 1000:.2f}ms",
+            ''.join(bars[math.ceil(c / peak * 8)] for c in s['histogram']))
+    console.print(table)
+    for name, value in sorted(stats['counters'].items()):
+        console.print(f'{name}: {value}')
+
+
+def dump(path: Path):
+    """Write the profile as JSON, or as a Prometheus textfile for .prom."""
+    stats = summary()
+    if path.suffix != '.prom':
+        path.write_text(json.dumps(stats, indent=2))
+        return
+    lines = ['# TYPE imgmeta_span_seconds histogram']
+    for name, s in stats['spans'].items():
+        cumulative = 0
+        for bound, c in zip(BUCKETS, s['histogram']):
+            cumulative += c
+            le = '+Inf' if bound == math.inf else bound
+            lines.append(f'imgmeta_span_seconds_bucket{{span="{name}",'
+                         f'le="{le}"}} {cumulative}')
+        lines.append(f'imgmeta_span_seconds_sum{{span="{name}"}} '
+                     f"{s['total_s']}")
+        lines.append(f'imgmeta_span_seconds_count{{span="{name}"}} '
+                     f"{s['calls']}")
+    lines.append('# TYPE imgmeta_events_total counter')
+    for name, value in stats['counters'].items():
+        lines.append(f'imgmeta_events_total{{event="{name}"}} {value}')
+    # textfile collectors may read at any time, so replace atomically
+    tmp = path.with_suffix('.prom.tmp')
+    tmp.write_text('\n'.join(lines) + '\n')
+    tmp.replace(path)
@@ -1,83 +1,390 @@
 import itertools
+import multiprocessing
 import os
-import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
 from typing import List
 
-from exiftool import ExifTool, ExifToolHelper
 from exiftool.exceptions import ExifToolExecuteError
-from photosinfo.model import Girl
-from playhouse.shortcuts import model_to_dict
-from typer import Option, Typer
+from typer import BadParameter, Context, Option, Typer
 from typing_extensions import Annotated
 
-from imgmeta import console, get_progress
-from imgmeta.helper import diff_meta, get_img_path, show_diff
-from imgmeta.meta import ImageMetaUpdate, rename_single_img
+from imgmeta import console, get_progress, profile
+from imgmeta.cache import MetaCache
+from imgmeta.dedup import DupIndex
+from imgmeta.exif import (ExifToolPool, TagWriter, batched, get_meta,
+                          get_tags, iter_meta, read_batch, read_sidecars,
+                          sidecar_patch, sidecar_path)
+from imgmeta.helper import (MEDIA_EXT, diff_meta, diff_subset,
+                            get_img_path, scan_img_path, show_diff)
+from imgmeta.journal import Journal
+from imgmeta.meta import (RENAME_TAGS, ImageMetaUpdate, RenamePlanner,
+                          get_artist_info, prefetch_records)
+from imgmeta.mover import Mover
+from imgmeta.pipeline import Pipeline
 
 app = Typer()
 
 
+@app.callback()
+def main(ctx: Context,
+         profile_: Annotated[bool, Option(
+             '--profile', help='Print where the time went at the end.')
+         ] = False,
+         profile_output: Annotated[Path, Option(
+             help='Save the profile, as a Prometheus textfile for .prom '
+                  'and as JSON otherwise.')] = None):
+    if not (profile_ or profile_output):
+        return
+    profile.enable()
+
+    def done():
+        if profile_:
+            profile.report(console)
+        if profile_output:
+            profile.dump(profile_output)
+    ctx.call_on_close(done)
+
+
+def check_write_mode(sidecar: bool, journal: Path | None):
+    if sidecar and journal:
+        raise BadParameter('a journal is of in-place writes, not sidecars',
+                           param_hint="'--journal'")
+
+
+def write_results(pool: ExifToolPool, results: list[tuple],
+                  params: list[str] = None,
+                  sidecar: bool = False,
+                  journal: Journal = None) -> list[tuple]:
+    """
+    Write stage of write_meta and write_ins: write the to_write of each
+    (img, to_write, xmp_info, meta, error) result, into the sidecar of
+    img with sidecar, and record the error.
+
+    With journal, files are overwritten without backups once the values
+    from meta of the tags to write are recorded in it.
+    """
+    assert not (sidecar and journal)
+    if sidecar or journal:
+        # a sidecar is small and rewritten whole, a backup is of no use
+        params = [*(params or []), '-overwrite_original']
+    if journal:
+        journal.record((img, {k: meta.get(k, '') for k in to_write})
+                       for img, to_write, _, meta, _ in results if to_write)
+    writer = TagWriter(pool, params, batch_size=len(results) + 1)
+    for img, to_write, *_ in results:
+        if to_write:
+            writer.add(sidecar_path(img) if sidecar else img, to_write, img)
+    errors = {img: e for _, img, e in writer.flush()}
+    if journal:
+        journal.failed(img for img, e in errors.items() if e)
+    return [(img, to_write, xmp_info, meta, e or errors.get(img))
+            for img, to_write, xmp_info, meta, e in results]
+
+
 @app.command(help='Write meta to imgs')
 def write_meta(
         paths: List[Path],
         prompt: bool = False,
         time_fix: bool = False,
         move_with_exception: bool = False,
-        max_write: int = None):
+        max_write: int = None,
+        batch_size: int = 64,
+        jobs: int = 1,
+        cache: Annotated[bool, Option(
+            help='skip files found up to date by a previous run while '
+                 'unchanged on disk; changes to supplier records need '
+                 '--recheck or --no-cache')] = True,
+        recheck: Annotated[bool, Option(
+            help='process cached files again, reading their metadata '
+                 'from the cache')] = False,
+        scan_jobs: int = 1,
+        sidecar: bool = False,
+        journal: Path = None,
+        find_duplicates: bool = False,
+        skip_duplicates: bool = False):
+    """
+    Files found up to date by a previous run are skipped while they stay
+    unchanged on disk, unless recheck is set, in which case they are
+    processed again with their metadata served from the cache. Nothing
+    is skipped with prompt or time_fix, which resolve the conflicts that
+    runs without them give up on and leave files up to date with.
+
+    With sidecar, only the XMP tags set to a value are written, into
+    file.ext.xmp sidecars that reads merge and embed writes into the
+    files; the rest of the patch waits for a run without it.
+
+    With journal, files are overwritten in place, leaving no *_original
+    backups, and the previous values of the tags written are appended to
+    the journal file, which rollback writes back.
+
+    With find_duplicates, files with the same content as one found before
+    are reported. With skip_duplicates, they are not read and processed
+    but given the patch of that first file, unless the patch may depend
+    on the file name: when they are named differently and the
+    XMP:RawFileName of the first file is missing or one of the names.
+    """
+    check_write_mode(sidecar, journal)
     if not isinstance(paths, list):
         paths = [paths]
-    imgs = itertools.chain.from_iterable(
-        get_img_path(p) for p in paths)
+    # artists edited since a previous run in this process are read again
+    get_artist_info.cache_clear()
+    find_duplicates |= skip_duplicates
+    duplicate_of, patches, held_logs = {}, {}, {}
 
-    with (ExifToolHelper() as et,
-          ExifTool(common_args=['-G1', '-n']) as etl,
-          get_progress(disable=prompt) as progress):
+    def on_error(img: Path, e: ExifToolExecuteError):
+        console.log(e.stdout, e.stderr, e.cmd, style='error')
+        if not move_with_exception:
+            raise e
+        Path('./problem').mkdir(exist_ok=True)
+        new_img = Path('./problem')/img.name
+        if new_img != img:
+            assert not new_img.exists()
+            img.rename(new_img)
+        console.log(f'{e}: {img}', style='error')
+        console.log(f'{img} moved to {new_img}', style='error')
+
+    def skip_cached(imgs):
+        for img in imgs:
+            if meta_cache.fresh(img):
+                progress.advance(task)
+            else:
+                yield img
 
-        count = 0
+    def flag_duplicates(imgs):
+        index = DupIndex()
+        for img in imgs:
+            if primary := index.add(img):
+                console.log(f'{img}: same content as {primary}',
+                            style='notice')
+                if skip_duplicates:
+                    duplicate_of[img] = primary
+            yield img
 
-        for img in progress.track(list(imgs), description='writing meta...'):
-            try:
-                meta = et.get_metadata(img)[0]
-                meta |= etl.execute_json(str(img), '-Keys:GPSCoordinates')[0]
-                xmp_info = ImageMetaUpdate(
-                    meta, prompt, time_fix).process_meta()
-                if to_write := diff_meta(xmp_info, meta):
-                    for k, v in to_write.copy().items():
-                        if isinstance(v, str):
-                            to_write[k] = v.replace('\n', '&#x0a;')
-
-                    et.set_tags(img, to_write, params=[
-                                '-ignoreMinorErrors', '-escapeHTML'])
+    def reuse_patch(img: Path, primary: Path) -> tuple | None:
+        if (patch := patches.get(primary)) is None:
+            return
+        to_write, modified, original, raw = patch
+        if img.name != primary.name and (
+                not raw or raw in (img.name, primary.name)):
+            return
+        return img, to_write, modified, original, None
+
+    def read_chunk(chunk):
+        todo = [img for img in chunk if img not in duplicate_of]
+        metas = iter(pool.run(read_batch, todo, read) if todo else [])
+        return [(img, None if img in duplicate_of else next(metas))
+                for img in chunk]
+
+    def process(img: Path, meta: dict | None) -> tuple:
+        if (primary := duplicate_of.get(img)) and (
+                result := reuse_patch(img, primary)):
+            return result
+        try:
+            meta = meta or pool.run(get_meta, [img])[0]
+        except ExifToolExecuteError as e:
+            return img, None, None, None, e
+        xmp_info = ImageMetaUpdate(meta, prompt, time_fix).process_meta()
+        to_write = diff_meta(xmp_info, meta)
+        if not to_write and meta_cache:
+            meta_cache.put(img, meta, xmp_info)
+        if sidecar:
+            # the rest of the patch keeps the file out of the cache
+            to_write = sidecar_patch(to_write)
+        if skip_duplicates:
+            patches[img] = (to_write, *diff_subset(to_write, xmp_info, meta),
+                            meta.get('XMP:RawFileName'))
+        return img, to_write, xmp_info, meta, None
+
+    def transform(items):
+        nonlocal planned
+        prefetch_records(meta for _, meta in items if meta)
+        results = []
+        for img, meta in items:
+            if max_write and planned >= max_write:
+                break
+            # off the main thread, logs wait to be shown with the result
+            with nullcontext([]) if prompt else console.hold_logs() as logs:
+                result = process(img, meta)
+            held_logs[img] = logs
+            planned += bool(result[1])
+            results.append(result)
+        return results
+
+    with (ExifToolPool(jobs) as pool,
+          MetaCache() if cache else nullcontext() as meta_cache,
+          Journal(journal) if journal else nullcontext() as jnl,
+          get_progress(disable=prompt) as progress):
+        task = progress.add_task('writing meta...', total=None)
+        imgs = scan_img_path(paths, progress, task, jobs=scan_jobs)
+        read = get_meta
+        if meta_cache and recheck:
+            read = meta_cache.cached_read(read)
+        elif meta_cache and not (prompt or time_fix):
+            imgs = skip_cached(imgs)
+        if find_duplicates:
+            imgs = flag_duplicates(imgs)
+        planned = written = 0
+        pipeline = Pipeline(batched(imgs, batch_size)).stage(
+            read_chunk, workers=jobs
+        ).stage(
+            # prefetch_records keeps the records of one batch at a time
+            transform, main_thread=prompt
+        ).stage(
+            partial(write_results, pool,
+                    params=['-ignoreMinorErrors', '-escapeHTML'],
+                    sidecar=sidecar, journal=jnl),
+            workers=jobs)
+        for results in pipeline:
+            for img, to_write, xmp_info, meta, e in results:
+                progress.advance(task)
+                console.replay_logs(held_logs.pop(img))
+                if e:
+                    on_error(img, e)
+                elif to_write:
+                    if meta_cache:
+                        meta_cache.invalidate(img)
                     console.log(img, style='bold')
                     show_diff(xmp_info, meta)
                     console.log()
-                    if max_write and (count := count + 1) >= max_write:
-                        break
-            except ExifToolExecuteError as e:
+            written += sum(bool(r[1]) for r in results)
+            if max_write and written >= max_write:
+                break
+    info = get_artist_info.cache_info()
+    console.log(f'artist cache: {info.hits} hits, {info.misses} misses',
+                style='info')
+
+
+@app.command(help='Compute the meta to write to imgs into a plan')
+def plan(paths: List[Path],
+         output: Annotated[Path, Option('--output', '-o')] = Path(
+             'plan.jsonl'),
+         time_fix: bool = False,
+         batch_size: int = 64,
+         jobs: int = os.cpu_count(),
+         scan_jobs: int = 1):
+    from imgmeta.plan import dump_entry, init_worker, plan_chunk
+    if not isinstance(paths, list):
+        paths = [paths]
+    planned = errors = 0
+    # forked after the scan and progress threads start, workers could
+    # inherit their locks held
+    mp_context = multiprocessing.get_context('forkserver')
+    with (ProcessPoolExecutor(jobs, mp_context=mp_context,
+                              initializer=init_worker) as executor,
+          get_progress() as progress,
+          output.open('w') as f):
+        task = progress.add_task('planning...', total=None)
+        chunks = batched(scan_img_path(paths, progress, task,
+                                       jobs=scan_jobs), batch_size)
+        futures = deque()
+        for chunk in itertools.chain(chunks, [None]):
+            if chunk:
+                futures.append((len(chunk), executor.submit(
+                    plan_chunk, [str(img) for img in chunk], time_fix)))
+            while futures and (not chunk or len(futures) > 2 * jobs):
+                size, future = futures.popleft()
+                for entry in future.result():
+                    if 'error' in entry:
+                        errors += 1
+                        console.log(f"{entry['file']}: {entry['error']}",
+                                    entry['stderr'], style='error')
+                    else:
+                        planned += 1
+                    f.write(dump_entry(entry) + '\n')
+                progress.advance(task, size)
+    console.log(f'{planned} files to write, {errors} errors => {output}')
+
+
+@app.command(help='Write the meta of a plan to imgs')
+def apply(plan_file: Path,
+          force: bool = False,
+          batch_size: int = 64,
+          jobs: int = 1,
+          journal: Path = None):
+    from imgmeta.plan import is_stale, load_plan
+    entries = [e for e in load_plan(plan_file) if 'error' not in e]
+
+    def fresh(entries):
+        for entry in entries:
+            if not force and is_stale(entry):
+                console.log(f"{entry['file']} changed since planned, skip",
+                            style='warning')
+                continue
+            yield entry
+
+    def on_written(results):
+        for img, entry, e in results:
+            if e:
                 console.log(e.stdout, e.stderr, e.cmd, style='error')
-                if not move_with_exception:
-                    raise
-                Path('./problem').mkdir(exist_ok=True)
-                new_img = Path('./problem')/img.name
-                if new_img != img:
-                    assert not new_img.exists()
-                    img.rename(new_img)
-                console.log(f'{e}: {img}', style='error')
-                console.log(f'{img} moved to {new_img}', style='error')
+                if jnl:
+                    jnl.failed([img])
+                continue
+            console.log(img, style='bold')
+            show_diff(entry['modified'], entry['original'])
+            console.log()
+
+    params = ['-ignoreMinorErrors', '-escapeHTML']
+    if journal:
+        params.append('-overwrite_original')
+    with (ExifToolPool(jobs) as pool, get_progress() as progress,
+          Journal(journal) if journal else nullcontext() as jnl):
+        writer = TagWriter(pool, params=params, batch_size=batch_size)
+        for chunk in batched(fresh(progress.track(
+                entries, description='applying...')), batch_size):
+            if jnl:
+                jnl.record((e['file'], {
+                    k: e['original'].get(k, '') for k in e['to_write']})
+                    for e in chunk)
+            for entry in chunk:
+                img = Path(entry['file'])
+                on_written(writer.add(img, entry['to_write'], entry))
+        on_written(writer.flush())
 
 
 @app.command()
-def write_ins():
+def write_ins(jobs: int = 1,
+              move_jobs: int = 4,
+              verify: Annotated[bool, Option(
+                  help='checksum copies across volumes before '
+                  'removing the source')] = False,
+              sidecar: bool = False,
+              journal: Path = None):
+    check_write_mode(sidecar, journal)
     from insmeta.model import Artist as InsArtist
     stogram = Path.home()/'Pictures/4K Stogram'
     if not (p := Path('/Volumes/Art')).exists():
         p = Path.home()/'Pictures'
     dst_path = p/'Instagram'
     imgs = list(get_img_path(stogram))
-    with (ExifToolHelper() as et, get_progress() as progress):
-        for img in progress.track(imgs):
-            meta = et.get_metadata(img)[0]
+    folders = {None: dst_path / 'None'}
+    get_artist_info.cache_clear()
+    held_logs = {}
+
+    def move(img: Path, xmp_info: dict):
+        uid = xmp_info.get('XMP:ImageSupplierID')
+        if (img_path := folders.get(uid)) is None:
+            is_new = InsArtist.get(user_id=uid).photos_num == 0
+            img_path = folders[uid] = dst_path / ('New' if is_new else 'User')
+        new_img = img_path / img.name
+        mover.move(img, new_img)
+        if (xmp := sidecar_path(img)).exists():
+            mover.move(xmp, sidecar_path(new_img))
+        console.log(
+            f'moving {img} to {new_img}...', style='bold')
+
+    def read_chunk(chunk):
+        return list(zip(chunk, pool.run(read_batch, chunk, read)))
+
+    def transform(items):
+        prefetch_records(meta | {"XMP:ImageSupplierName": "Instagram"}
+                         for _, meta in items if meta)
+        results = []
+        for img, meta in items:
+            meta = meta or pool.run(read, [img])[0]
             patch = {
                 "XMP:ImageSupplierName": "Instagram",
                 "EXIF:UserComment": "",
@@ -85,26 +392,115 @@ def write_ins():
                 "EXIF:Artist": "",
             }
             patch = {k: v for k, v in patch.items() if v or k in meta}
-            xmp_info = ImageMetaUpdate(meta | patch).process_meta()
+            with console.hold_logs() as held_logs[img]:
+                xmp_info = ImageMetaUpdate(meta | patch).process_meta()
             xmp_info |= patch
-            if to_write := diff_meta(xmp_info, meta):
-                et.set_tags(img, to_write)
-                console.log(img, style='bold')
-                show_diff(xmp_info, meta)
-
-            if (uid := xmp_info.get('XMP:ImageSupplierID')) is None:
-                img_path = dst_path / 'None'
-            elif InsArtist.get(user_id=uid).photos_num == 0:
-                img_path = dst_path / 'New'
+            to_write = diff_meta(xmp_info, meta)
+            if sidecar:
+                to_write = sidecar_patch(to_write)
+            results.append((img, to_write, xmp_info, meta, None))
+        return results
+
+    read = partial(get_meta, gps=False)
+    with (ExifToolPool(jobs) as pool, get_progress() as progress,
+          Journal(journal) if journal else nullcontext() as jnl,
+          Mover(move_jobs, verify=verify,
+                on_moved=jnl.moved if jnl else None) as mover):
+        pipeline = Pipeline(batched(imgs, 64)).stage(
+            read_chunk, workers=jobs
+        ).stage(
+            transform
+        ).stage(
+            partial(write_results, pool, sidecar=sidecar, journal=jnl),
+            workers=jobs)
+        task = progress.add_task('writing ins...', total=len(imgs))
+        for results in pipeline:
+            for img, to_write, xmp_info, meta, e in results:
+                progress.advance(task)
+                console.replay_logs(held_logs.pop(img))
+                if e:
+                    raise e
+                if to_write:
+                    console.log(img, style='bold')
+                    show_diff(xmp_info, meta)
+                move(img, xmp_info)
+    info = get_artist_info.cache_info()
+    console.log(f'artist cache: {info.hits} hits, {info.misses} misses',
+                style='info')
+
+
+@app.command(help='Restore the tags written by a run from its journal')
+def rollback(journal: Path, batch_size: int = 64, jobs: int = 1):
+    from imgmeta.journal import load_journal
+    restore = load_journal(journal)
+
+    def on_written(results):
+        for img, _, e in results:
+            if e:
+                console.log(e.stdout, e.stderr, e.cmd, style='error')
             else:
-                img_path = dst_path / 'User'
+                console.log(f'restored {img}')
+
+    params = ['-overwrite_original', '-ignoreMinorErrors', '-escapeHTML']
+    with (ExifToolPool(jobs) as pool, get_progress() as progress):
+        writer = TagWriter(pool, params=params, batch_size=batch_size)
+        for file, tags in progress.track(
+                restore.items(), description='rolling back...'):
+            if not (img := Path(file)).exists():
+                console.log(f'{img} not found, skip', style='warning')
+                continue
+            on_written(writer.add(img, tags))
+        on_written(writer.flush())
+
 
-            img_path.mkdir(exist_ok=True, parents=True)
-            new_img = img_path / img.name
-            assert not (new_img).exists()
-            shutil.move(img, new_img)
-            console.log(
-                f'moving {img} to {new_img}...', style='bold')
+@app.command(help='Write the .xmp sidecars of imgs into them')
+def embed(paths: List[Path], batch_size: int = 64, jobs: int = 1):
+    """
+    Fold the sidecars left by --sidecar into their files, batch_size
+    files per exiftool call, removing each sidecar once written.
+    """
+    if not isinstance(paths, list):
+        paths = [paths]
+    imgs = [img for p in paths for img in get_img_path(p)
+            if sidecar_path(img).exists()]
+    read = partial(get_meta, gps=False, sidecars=False)
+
+    def read_chunk(chunk):
+        metas = pool.run(read_batch, chunk, read)
+        xmps = pool.run(
+            lambda et, _: read_sidecars(et, [str(img) for img in chunk]))
+        results = []
+        for img, meta in zip(chunk, metas):
+            try:
+                meta = meta or pool.run(read, [img])[0]
+            except ExifToolExecuteError as e:
+                results.append((img, None, None, None, e))
+                continue
+            to_write = {}
+            for k, v in xmps[str(img)].items():
+                if v != (o := meta.get(k)) and str(v) != str(o):
+                    to_write[k] = v
+            results.append((img, to_write, None, meta, None))
+        return results
+
+    with (ExifToolPool(jobs) as pool, get_progress() as progress):
+        pipeline = Pipeline(batched(imgs, batch_size)).stage(
+            read_chunk, workers=jobs
+        ).stage(
+            partial(write_results, pool,
+                    params=['-ignoreMinorErrors', '-escapeHTML']),
+            workers=jobs)
+        task = progress.add_task('embedding sidecars...', total=len(imgs))
+        for results in pipeline:
+            for img, to_write, _, _, e in results:
+                progress.advance(task)
+                if e:
+                    console.log(e.stdout, e.stderr, e.cmd, style='error')
+                    console.log(f'{e}: {img}, sidecar kept', style='error')
+                    continue
+                if to_write:
+                    console.log(f'embedding {list(to_write)} in {img}')
+                sidecar_path(img).unlink()
 
 
 @app.command(help='Rename imgs and videos')
@@ -115,14 +511,17 @@ def rename(paths: List[Path],
            sep_mp4: Annotated[bool, Option('--sep-mp4', '-s')] = False,
            sep_mov: Annotated[bool, Option('--sep-mov', '-m')] = False,
            sep_new: Annotated[bool, Option('--sep-new', '-n')] = False,
-           sep_folder: Annotated[bool, Option('--sep-folder', '-f')] = False
-
+           sep_folder: Annotated[bool, Option('--sep-folder', '-f')] = False,
+           jobs: int = 1,
+           dry_run: bool = False
            ):
     assert not (sep_new and root)
     if not isinstance(paths, list):
         paths = [paths]
     imgs = itertools.chain.from_iterable(
         get_img_path(p) for p in paths)
+    from photosinfo.model import Girl
+    from playhouse.shortcuts import model_to_dict
     new_ids = {}
     for girl in Girl:
         girl_dict = model_to_dict(girl)
@@ -133,11 +532,14 @@ def rename(paths: List[Path],
     old_ids = {str(uid) for uid, num in new_ids.items() if num > 0}
     name2folder = {g.username: g.folder for g in Girl if g.folder}
 
-    with (get_progress() as progress, ExifToolHelper() as et):
-        for img in progress.track(list(imgs), description='renaming imgs...'):
-            if img.suffix == '.mov' and sep_mov:
-                continue
-            meta = et.get_metadata(img)[0]
+    imgs = [img for img in imgs if not (img.suffix == '.mov' and sep_mov)]
+    read = partial(get_tags, tags=RENAME_TAGS)
+    planner = RenamePlanner()
+    with (get_progress() as progress, ExifToolPool(jobs) as pool):
+        for img, meta in progress.track(
+                iter_meta(pool, imgs, read=read),
+                total=len(imgs), description='planning renames...'):
+            meta = meta or pool.run(read, [img])[0]
             fpath = [root] if root else []
             if (uid := meta.get('XMP:ImageSupplierID')) is None:
                 subfolder = 'None'
@@ -153,7 +555,8 @@ def rename(paths: List[Path],
                 fpath.append(album_folder)
             r = Path(*fpath) if fpath else None
 
-            rename_single_img(img, meta, new_dir, r, sep_mp4, sep_mov)
+            planner.add(img, meta, new_dir, r, sep_mp4, sep_mov)
+    planner.run(dry_run)
 
 
 @app.command(help='Rename imgs and videos')
@@ -163,14 +566,17 @@ def rename_awe(paths: List[Path],
                root: Path = None,
                sep_new: Annotated[bool, Option('--sep-new', '-n')] = False,
                sep_folder: Annotated[bool, Option(
-                   '--sep-folder', '-f')] = False
-
+                   '--sep-folder', '-f')] = False,
+               jobs: int = 1,
+               dry_run: bool = False
                ):
     assert not (sep_new and root)
     if not isinstance(paths, list):
         paths = [paths]
     imgs = itertools.chain.from_iterable(
         get_img_path(p) for p in paths)
+    from photosinfo.model import Girl
+    from playhouse.shortcuts import model_to_dict
     new_ids = {}
     for girl in Girl:
         girl_dict = model_to_dict(girl)
@@ -181,9 +587,14 @@ def rename_awe(paths: List[Path],
     old_ids = {uid for uid, num in new_ids.items() if num > 0}
     name2folder = {g.username: g.folder for g in Girl if g.folder}
 
-    with (get_progress() as progress, ExifToolHelper() as et):
-        for img in progress.track(list(imgs), description='renaming imgs...'):
-            meta = et.get_metadata(img)[0]
+    imgs = list(imgs)
+    read = partial(get_tags, tags=RENAME_TAGS)
+    planner = RenamePlanner()
+    with (get_progress() as progress, ExifToolPool(jobs) as pool):
+        for img, meta in progress.track(
+                iter_meta(pool, imgs, read=read),
+                total=len(imgs), description='planning renames...'):
+            meta = meta or pool.run(read, [img])[0]
             fpath = [root] if root else []
             if (uid := meta.get('XMP:ImageSupplierID')) is None:
                 subfolder = 'None'
@@ -199,26 +610,83 @@ def rename_awe(paths: List[Path],
             fpath.append(img.suffix[1:])
             r = Path(*fpath) if fpath else None
 
-            rename_single_img(img, meta, new_dir, r, sep_mp4=False)
+            planner.add(img, meta, new_dir, r, sep_mp4=False)
+    planner.run(dry_run)
 
 
 @app.command(help='Clean files')
-def clean_file(path: Path):
-    media_ext = ('.jpg', '.mov', '.png', '.jpeg',
-                 '.mp4', '.gif', '.heic', '.webp')
-    fmt = {f'{ext}_original' for ext in media_ext}
+def clean_file(path: Path, dry_run: bool = False, jobs: int = 8):
+    """Remove exiftool backups and .DS_Store files, then emptied dirs."""
+    fmt = {f'{ext}_original' for ext in MEDIA_EXT}
     assert path.is_dir()
-    for file in path.iterdir():
-        if file.is_dir():
-            clean_file(file)
+    files, dirs, kept = [], [], {}
+    reclaimable = 0
+    stack = [str(path)]
+    while stack:
+        dirs.append(folder := stack.pop())
+        kept[folder] = 0
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                    kept[folder] += 1
+                    continue
+                if (suf := os.path.splitext(entry.name)[1]
+                        ).endswith('_original'):
+                    assert suf in fmt
+                elif entry.name != '.DS_Store':
+                    kept[folder] += 1
+                    continue
+                files.append(entry.path)
+                if dry_run:
+                    reclaimable += entry.stat(follow_symlinks=False).st_size
+    verb = 'would remove' if dry_run else 'removing'
+    with ThreadPoolExecutor(jobs) as executor:
+        for file in (files if dry_run else
+                     executor.map(lambda f: os.unlink(f) or f, files)):
+            console.log(f"{verb} {file}")
+    # dirs lists parents before children, so reversed it is bottom-up
+    for folder in reversed(dirs):
+        if kept[folder] or Path(folder) == Path('.'):
             continue
-        if (suf := file.suffix).endswith('_original'):
-            assert suf in fmt
-        elif file.name != '.DS_Store':
-            continue
-        console.log(f"removing {file}")
-        file.unlink()
-    if path == Path('.') or any(path.iterdir()):
-        return
-    console.log(f"removing {path}")
-    os.rmdir(path)
+        console.log(f"{verb} {folder}")
+        if not dry_run:
+            os.rmdir(folder)
+        if (parent := os.path.dirname(folder)) in kept:
+            kept[parent] -= 1
+    if dry_run:
+        console.log(f'{len(files)} files, {reclaimable / 2**20:.1f} MiB '
+                    'reclaimable')
+
+
+@app.command(help='Process imgs and videos as they land in paths')
+def watch(paths: List[Path],
+          rename_to: Annotated[Path, Option(
+              help='rename processed files into folders under it')] = None,
+          settle: Annotated[float, Option(
+              help='seconds a file must stay unchanged')] = 2.0,
+          catch_up: Annotated[bool, Option(
+              help='also process what landed while not watching')] = True,
+          batch_size: int = 64,
+          jobs: int = 1):
+    from imgmeta.watch import Settler, signature
+    from imgmeta.watch import watch as watch_paths
+    settler = Settler(settle)
+
+    def process(batch: list[Path]):
+        write_meta(batch, move_with_exception=True, jobs=jobs)
+        # what was written, or renamed below, must not come back as new
+        settler.done.update(signature(p) for p in batch)
+        if rename_to and (batch := [p for p in batch if p.exists()]):
+            rename(batch, new_dir=True, root=rename_to, jobs=jobs)
+
+    existing = (img for p in paths for img in get_img_path(p))
+    console.log(f'watching {", ".join(map(str, paths))}...', style='notice')
+    for batch in watch_paths(paths, settler, batch_size,
+                             existing if catch_up else ()):
+        try:
+            process(batch)
+        except Exception:
+            console.print_exception()
+            console.log(f'{len(batch)} files left unprocessed',
+                        style='error')
@@ -0,0 +1,110 @@
+"""
+Pick up media files as they land, for `imgmeta watch`.
+"""
+import os
+import queue
+import time
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from imgmeta.exif import batched
+from imgmeta.helper import MEDIA_EXT
+
+EVENTS = {'created', 'modified', 'moved', 'closed'}
+
+
+def _is_media(path: str) -> bool:
+    p = Path(path)
+    return (p.suffix.lower().endswith(MEDIA_EXT)
+            and not any(part.startswith('.') for part in p.parts))
+
+
+def signature(path) -> tuple | None:
+    """What changes when a file is written, and survives its renames."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class Settler:
+    """
+    Files seen changing, handed out once they have been left alone.
+
+    A file is settled once no event came for it for settle seconds and
+    its size and mtime are still those of the last event, which tells
+    finished downloads from partial ones whatever the downloader does.
+    Files whose signature is in done, which imgmeta wrote itself, are
+    dropped rather than processed again.
+    """
+
+    def __init__(self, settle: float = 2.0):
+        self.settle = settle
+        self.done = set()
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def touch(self, path: str):
+        self._pending[path] = (signature(path), time.monotonic())
+
+    def pop_settled(self) -> list[Path]:
+        now = time.monotonic()
+        settled = []
+        for path, (sig, since) in list(self._pending.items()):
+            if now - since < self.settle:
+                continue
+            if (new := signature(path)) != sig:
+                self._pending[path] = (new, now)
+                continue
+            del self._pending[path]
+            if sig and sig not in self.done:
+                settled.append(Path(path))
+        return settled
+
+
+def watch(paths: list[Path], settler: Settler, batch_size: int = 64,
+          existing: Iterable[Path] = ()) -> Iterator[list[Path]]:
+    """
+    Yield batches of the media files settling under paths, forever.
+
+    Events are collected by watchdog, on inotify or FSEvents, from its
+    own thread; the settled files are sorted by path. The existing files,
+    which landed while not watching, are listed once the observer runs
+    so that none slips in between, and settle like the others.
+    """
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+
+    events = queue.SimpleQueue()
+
+    class Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if event.is_directory or event.event_type not in EVENTS:
+                return
+            for path in [event.src_path, getattr(event, 'dest_path', '')]:
+                if path and _is_media(path):
+                    events.put(os.fsdecode(path))
+
+    observer = Observer()
+    for path in paths:
+        observer.schedule(Handler(), str(path), recursive=True)
+    observer.start()
+    for path in existing:
+        settler.touch(str(path))
+    poll = settler.settle / 4
+    try:
+        while True:
+            deadline = time.monotonic() + poll
+            while (timeout := deadline - time.monotonic()) > 0:
+                try:
+                    settler.touch(events.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if settler and (settled := settler.pop_settled()):
+                yield from batched(sorted(settled), batch_size)
+    finally:
+        observer.stop()
+        observer.join()
@@ -0,0 +1,272 @@
+"""
+Read XMP tags in process, without exiftool, for the common formats.
+
+read_tags locates the XMP packet of a JPEG (APP1 segment), PNG (iTXt
+chunk), MP4 (top-level uuid box) or MOV (moov/udta/XMP_ box) through the
+segment, chunk or box headers of the memory-mapped file, so that only
+the pages of the headers and of the packet are read, and shapes the
+values of the tags of TAGS as `exiftool -j -G -n` does. It returns None
+whenever exiftool should be asked instead: other formats, extended XMP,
+several packets, or tags it does not know or may be confused about.
+"""
+import json
+import mmap
+import re
+import struct
+import zlib
+from collections import defaultdict
+from pathlib import Path
+from xml.etree import ElementTree
+
+RDF = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
+XML = 'http://www.w3.org/XML/1998/namespace'
+PLUS = 'http://ns.useplus.org/ldf/xmp/1.0/'
+
+# tag: (namespace, property, struct field)
+TAGS = {
+    'XMP:Artist': ('http://ns.adobe.com/tiff/1.0/', 'Artist', None),
+    'XMP:DateCreated': (
+        'http://ns.adobe.com/photoshop/1.0/', 'DateCreated', None),
+    'XMP:ImageCreatorName': (PLUS, 'ImageCreator', 'ImageCreatorName'),
+    'XMP:ImageSupplierID': (PLUS, 'ImageSupplier', 'ImageSupplierID'),
+    'XMP:ImageSupplierName': (PLUS, 'ImageSupplier', 'ImageSupplierName'),
+    'XMP:RawFileName': (
+        'http://ns.adobe.com/camera-raw-settings/1.0/', 'RawFileName', None),
+    'XMP:SeriesNumber': ('http://ns.adobe.com/DICOM/', 'SeriesNumber', None),
+}
+DATE_TAGS = {'XMP:DateCreated'}
+
+JPEG_XMP = b'http://ns.adobe.com/xap/1.0/\0'
+JPEG_EXTENDED_XMP = b'http://ns.adobe.com/xmp/extension/\0'
+PNG_XMP = b'XML:com.adobe.xmp\0'
+MP4_XMP = bytes.fromhex('BE7ACFCB97A942E89C71999491E3AFAC')
+HEIF_BRANDS = {b'heic', b'heix', b'heim', b'heis', b'hevc', b'mif1',
+               b'msf1', b'avif'}
+QUICKTIME_BOXES = {b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip'}
+
+# the numbers exiftool leaves unquoted in JSON
+_NUMBER = re.compile(r'-?(\d|[1-9]\d{1,14})(\.\d{1,16})?(e[-+]?\d{1,3})?',
+                     re.I)
+_XMP_DATE = re.compile(r'(\d{4})-(\d{2})-(\d{2})T(\d{2}:\d{2})(:\d{2})?(\S*)')
+
+
+class Unsupported(Exception):
+    """Raised for what is left to exiftool."""
+
+
+def sidecar_path(img) -> Path:
+    """The XMP sidecar of img, named after it as file.ext.xmp."""
+    return Path(f'{img}.xmp')
+
+
+def _jpeg(mm) -> list[bytes]:
+    packets = []
+    pos = 2
+    while pos + 4 <= len(mm):
+        if mm[pos] != 0xFF:
+            raise Unsupported('bad jpeg segment')
+        marker = mm[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in (0xD9, 0xDA):
+            # metadata segments all come before the scan
+            break
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            pos += 2
+            continue
+        length, = struct.unpack_from('>H', mm, pos + 2)
+        start, end = pos + 4, pos + 2 + length
+        if marker == 0xE1:
+            if mm[start:start + len(JPEG_XMP)] == JPEG_XMP:
+                packets.append(mm[start + len(JPEG_XMP):end])
+            elif (mm[start:start + len(JPEG_EXTENDED_XMP)]
+                  == JPEG_EXTENDED_XMP):
+                raise Unsupported('extended xmp')
+        pos = end
+    return packets
+
+
+def _png(mm) -> list[bytes]:
+    packets = []
+    pos = 8
+    while pos + 8 <= len(mm):
+        length, kind = struct.unpack_from('>I4s', mm, pos)
+        start, end = pos + 8, pos + 8 + length
+        if mm[start:start + len(PNG_XMP)] == PNG_XMP:
+            if kind != b'iTXt':
+                raise Unsupported(f'xmp in {kind}')
+            data = mm[start + len(PNG_XMP):end]
+            compressed = data[0]
+            # skip the method, the language tag and the translated keyword
+            text = data[data.index(b'\0', data.index(b'\0', 2) + 1) + 1:]
+            packets.append(zlib.decompress(text) if compressed else text)
+        elif kind == b'IEND':
+            break
+        pos = end + 4
+    return packets
+
+
+def _boxes(mm, start: int, end: int):
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', mm, pos)
+        header = 8
+        if size == 1:
+            size, = struct.unpack_from('>Q', mm, pos + 8)
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise Unsupported(f'bad {kind} box')
+        yield kind, pos + header, pos + size
+        pos += size
+
+
+def _bmff(mm) -> list[bytes]:
+    if mm[4:8] == b'ftyp' and mm[8:12] in HEIF_BRANDS:
+        # the xmp of heif is an item of the meta box
+        raise Unsupported('heif')
+    packets = []
+    for kind, start, end in _boxes(mm, 0, len(mm)):
+        if kind == b'uuid' and mm[start:start + 16] == MP4_XMP:
+            packets.append(mm[start + 16:end])
+        elif kind == b'meta':
+            raise Unsupported('meta box')
+        elif kind == b'moov':
+            for kind, start, end in _boxes(mm, start, end):
+                if kind != b'udta':
+                    continue
+                for kind, start, end in _boxes(mm, start, end):
+                    if kind == b'XMP_':
+                        packets.append(mm[start:end])
+    return packets
+
+
+def find_packets(path) -> list[bytes]:
+    with open(path, 'rb') as f:
+        if not f.seek(0, 2):
+            raise Unsupported('empty file')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:2] == b'\xff\xd8':
+                return _jpeg(mm)
+            if mm[:8] == b'\x89PNG\r\n\x1a\n':
+                return _png(mm)
+            if mm[4:8] in QUICKTIME_BOXES:
+                return _bmff(mm)
+    raise Unsupported('format')
+
+
+def _name(tag: str) -> tuple[str, str]:
+    ns, _, name = tag[1:].partition('}')
+    return ns, name
+
+
+def _attributes(elem) -> dict:
+    return {_name(k): v for k, v in elem.attrib.items()
+            if not k.startswith((f'{{{RDF}}}', f'{{{XML}}}'))}
+
+
+def _struct(elem) -> dict:
+    fields = _attributes(elem)
+    for child in elem:
+        fields[_name(child.tag)] = _value(child)
+    if any(ns == RDF for ns, _ in fields):
+        raise Unsupported('qualifiers')
+    return fields
+
+
+def _value(elem):
+    if (resource := elem.get(f'{{{RDF}}}resource')) is not None:
+        return resource
+    if elem.get(f'{{{RDF}}}parseType') == 'Resource':
+        return _struct(elem)
+    if not len(elem):
+        return _struct(elem) if _attributes(elem) else elem.text or ''
+    if len(elem) > 1:
+        raise Unsupported('mixed content')
+    child = elem[0]
+    if child.tag in (f'{{{RDF}}}Bag', f'{{{RDF}}}Seq'):
+        return [_value(li) for li in child]
+    if child.tag == f'{{{RDF}}}Alt':
+        items = {li.get(f'{{{XML}}}lang'): _value(li) for li in child}
+        return items.get('x-default', next(iter(items.values()), ''))
+    if child.tag == f'{{{RDF}}}Description':
+        return _struct(child)
+    raise Unsupported(f'{child.tag} value')
+
+
+def parse_packet(packet: bytes) -> dict[tuple, list]:
+    """The top-level properties of packet, {(namespace, name): values}."""
+    root = ElementTree.fromstring(packet.strip(b'\0 \t\r\n'))
+    if root.tag != f'{{{RDF}}}RDF':
+        root = root.find(f'.//{{{RDF}}}RDF')
+    props = defaultdict(list)
+    for desc in root.iterfind(f'{{{RDF}}}Description'):
+        for name, v in _attributes(desc).items():
+            props[name].append(v)
+        for child in desc:
+            props[_name(child.tag)].append(_value(child))
+    return props
+
+
+def _json_value(value: str, date: bool):
+    if date and (m := _XMP_DATE.fullmatch(value)):
+        # exiftool converts xmp dates back to the exif format
+        y, mo, d, hm, s, zone = m.groups()
+        return f'{y}:{mo}:{d} {hm}{s or ":00"}{zone}'
+    if date and re.match(r'\d{4}(-\d{2}){0,2}', value):
+        return value.replace('-', ':')
+    if _NUMBER.fullmatch(value):
+        return json.loads(value.lower())
+    if value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    return value
+
+
+def shape(props: dict, tags: list[str]) -> dict:
+    """The values of tags in props, as exiftool -j -G -n gives them."""
+    names = defaultdict(set)
+    for ns, name in props:
+        names[name.lower()].add(ns)
+    meta = {}
+    for tag in tags:
+        ns, prop, field = TAGS[tag]
+        if names[(field or prop).lower()] - {ns}:
+            raise Unsupported(f'{tag} in another namespace')
+        if not (values := props.get((ns, prop))):
+            continue
+        if len(values) > 1:
+            raise Unsupported(f'{tag} repeated')
+        items = values[0] if isinstance(values[0], list) else values
+        if field:
+            if not all(isinstance(s, dict) for s in items):
+                raise Unsupported(f'{tag} not a structure')
+            items = [s[(ns, field)] for s in items if (ns, field) in s]
+        if not all(isinstance(v, str) for v in items):
+            raise Unsupported(f'{tag} not text')
+        items = [_json_value(v, tag in DATE_TAGS) for v in items]
+        if items:
+            meta[tag] = items[0] if len(items) == 1 else items
+    return meta
+
+
+def read_tags(path, tags: list[str]) -> dict | None:
+    """
+    The tags of path, XMP tags of TAGS only, overridden by those of its
+    sidecar; None if exiftool is needed.
+    """
+    if not set(tags) <= TAGS.keys():
+        return
+    try:
+        if len(packets := find_packets(path)) > 1:
+            return
+        meta = {'SourceFile': str(path)}
+        if packets:
+            meta |= shape(parse_packet(packets[0]), tags)
+        if (sidecar := sidecar_path(path)).exists():
+            meta |= shape(parse_packet(sidecar.read_bytes()), tags)
+    except (Unsupported, ElementTree.ParseError, struct.error, ValueError,
+            zlib.error, OSError):
+        return
+    return meta
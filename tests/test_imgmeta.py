@@ -1,5 +1,179 @@
-from imgmeta import __version__
+import json
+import random
+import struct
+import time
+from contextlib import nullcontext
+
+import pytest
+from geopy.distance import geodesic
+
+from imgmeta import __version__, script
+from imgmeta.geo import distance, round_precision
+from imgmeta.journal import Journal
+from imgmeta.meta import RenamePlanner
+from imgmeta.mover import Mover
+from imgmeta.pipeline import Pipeline
+from imgmeta.xmp import read_tags
 
 
 def test_version():
     assert __version__ == '0.1.0'
+
+
+def test_geo_distance():
+    a, b = '31.2304 121.4737', (31.2394, 121.4737)
+    exact = geodesic(a, b).km
+    assert distance(a, b, thresholds=[1]) == exact
+    assert distance(a, b) == pytest.approx(exact, rel=0.006)
+    assert abs(distance(a, '39.9042 116.4074') - 1068) < 10
+    assert round_precision(31.5, 121.25) == (2, 0)
+
+
+def test_pipeline_order():
+    seen = []
+
+    def sleep(x):
+        time.sleep(random.random() / 1000)
+        return x
+
+    pipeline = Pipeline(range(100)).stage(sleep, workers=4).stage(
+        lambda x: seen.append(x) or -x, main_thread=True).stage(
+        sleep, workers=4)
+    assert list(pipeline) == [-x for x in range(100)]
+    assert seen == list(range(100))
+
+
+def test_xmp_read_tags(tmp_path):
+    packet = (
+        b"<x:xmpmeta xmlns:x='adobe:ns:meta/'><rdf:RDF xmlns:rdf="
+        b"'http://www.w3.org/1999/02/22-rdf-syntax-ns#'><rdf:Description "
+        b"xmlns:photoshop='http://ns.adobe.com/photoshop/1.0/' "
+        b"xmlns:plus='http://ns.useplus.org/ldf/xmp/1.0/' "
+        b"photoshop:DateCreated='2021-05-06T07:08+08:00'><plus:ImageSupplier>"
+        b"<rdf:Seq><rdf:li rdf:parseType='Resource'><plus:ImageSupplierID>"
+        b"123</plus:ImageSupplierID></rdf:li></rdf:Seq></plus:ImageSupplier>"
+        b"</rdf:Description></rdf:RDF></x:xmpmeta>")
+    app1 = b'http://ns.adobe.com/xap/1.0/\0' + packet
+    img = tmp_path / 'a.jpg'
+    img.write_bytes(b'\xff\xd8\xff\xe1' + struct.pack('>H', len(app1) + 2)
+                    + app1 + b'\xff\xda\x00\x02\xff\xd9')
+    tags = ['XMP:DateCreated', 'XMP:ImageSupplierID', 'XMP:Artist']
+    assert read_tags(img, tags) == {
+        'SourceFile': str(img), 'XMP:ImageSupplierID': 123,
+        'XMP:DateCreated': '2021:05:06 07:08:00+08:00'}
+    assert read_tags(img, ['XMP:Title']) is None
+
+
+def _rename_meta(minute: int) -> dict:
+    return {'XMP:RawFileName': 'raw.jpg', 'XMP:Artist': 'art',
+            'XMP:DateCreated': f'2021:05:06 07:{minute:02d}:00'}
+
+
+def _plan_renames(tmp_path, files: dict) -> RenamePlanner:
+    """Plan in place the renames of files, {name: minute of its date}."""
+    for name in files:
+        (tmp_path / name).write_text(name)
+    planner = RenamePlanner()
+    for name, minute in files.items():
+        planner.add(tmp_path / name, _rename_meta(minute), sep_mp4=False)
+    return planner
+
+
+def test_rename_planner_swap(tmp_path):
+    # each file is named as the other should be
+    planner = _plan_renames(tmp_path, {'art-21-05-06-0709.jpg': 8,
+                                       'art-21-05-06-0708.jpg': 9})
+    planned = {img.name: new.name for img, new, *_ in planner.moves}
+    planner.run()
+    for name, new in planned.items():
+        assert (tmp_path / new).read_text() == name
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_rename_planner_case_collision(tmp_path):
+    (tmp_path / 'ART-21-05-06-0708.JPG').write_text('other')
+    planner = _plan_renames(tmp_path, {'a.jpg': 8})
+    planner.run()
+    assert (tmp_path / 'ART-21-05-06-0708.JPG').read_text() == 'other'
+    assert (tmp_path / 'art-21-05-06-0708-01.jpg').read_text() == 'a.jpg'
+
+
+def test_rename_planner_sidecar(tmp_path):
+    (tmp_path / 'a.jpg.xmp').write_text('sidecar')
+    # an orphan sidecar at the target is not adopted
+    (tmp_path / 'art-21-05-06-0708.jpg.xmp').write_text('orphan')
+    planner = _plan_renames(tmp_path, {'a.jpg': 8})
+    planner.run()
+    new = tmp_path / 'art-21-05-06-0708-01.jpg'
+    assert new.read_text() == 'a.jpg'
+    assert (tmp_path / f'{new.name}.xmp').read_text() == 'sidecar'
+    assert not (tmp_path / 'a.jpg.xmp').exists()
+
+
+def test_rename_planner_dry_run(tmp_path):
+    planner = _plan_renames(tmp_path, {'a.jpg': 8, 'b.jpg': 8})
+    before = sorted(tmp_path.iterdir())
+    planner.run(dry_run=True)
+    assert sorted(tmp_path.iterdir()) == before
+    assert not planner.moves
+
+
+def test_clean_file(tmp_path):
+    files = ['a.jpg', 'a.jpg_original', '.DS_Store', 'sub/b.mp4_original',
+             'sub/.DS_Store', 'sub/deeper/c.mov_original', 'keep/d.png']
+    for name in files:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_text(name)
+    script.clean_file(tmp_path, dry_run=True)
+    assert all((tmp_path / name).exists() for name in files)
+    script.clean_file(tmp_path)
+    assert sorted(str(p.relative_to(tmp_path))
+                  for p in tmp_path.rglob('*')) == ['a.jpg', 'keep',
+                                                    'keep/d.png']
+
+
+class _StubWriter:
+    def __init__(self, pool, params=None, batch_size=64):
+        self.written = _StubWriter.written = {}
+
+    def add(self, img, tags, payload=None):
+        self.written[img] = tags
+        return [(img, payload, None)]
+
+    def flush(self):
+        return []
+
+
+def _rollback(monkeypatch, journal) -> dict:
+    monkeypatch.setattr(script, 'ExifToolPool', lambda jobs: nullcontext())
+    monkeypatch.setattr(script, 'TagWriter', _StubWriter)
+    script.rollback(journal)
+    return _StubWriter.written
+
+
+def test_journal_rollback(tmp_path, monkeypatch):
+    a, b, gone = (tmp_path / name for name in ['a.jpg', 'b.jpg', 'c.jpg'])
+    a.touch()
+    b.touch()
+    journal = tmp_path / 'journal.jsonl'
+    with Journal(journal) as jnl:
+        jnl.record([(a, {'XMP:Title': 'old\ntitle', 'XMP:Artist': ''}),
+                    (b, {'XMP:Title': 'b'}), (gone, {'XMP:Title': 'c'})])
+        jnl.failed([b])
+        # the earliest value recorded is the one restored
+        jnl.record([(a, {'XMP:Title': 'newer', 'XMP:Source': 'x'})])
+    with journal.open('a') as f:
+        f.write(json.dumps({'file': str(b), 'tags': {}})[:10])
+    assert _rollback(monkeypatch, journal) == {a: {
+        'XMP:Title': 'old\ntitle', 'XMP:Artist': '', 'XMP:Source': 'x'}}
+
+
+def test_journal_follows_moves(tmp_path, monkeypatch):
+    img, moved = tmp_path / 'a.jpg', tmp_path / 'User' / 'a.jpg'
+    img.touch()
+    journal = tmp_path / 'journal.jsonl'
+    with Journal(journal) as jnl:
+        jnl.record([(img, {'XMP:Title': 'old'})])
+        with Mover(on_moved=jnl.moved) as mover:
+            mover.move(img, moved)
+    assert _rollback(monkeypatch, journal) == {moved: {'XMP:Title': 'old'}}